@@ -1,38 +1,78 @@
 from django.contrib import admin
-from core.models import GitLabAPI, CalendarConfiguration
+from core.forms import CalendarConfigurationForm
+from core.models import GitLabAPI, CalendarConfiguration, GenerationJob, CalendarEvent, CompositeCalendar
 
 
 class CalendarConfigurationInLine(admin.TabularInline):
     model = CalendarConfiguration
+    form = CalendarConfigurationForm
+    fields = ['config_name', 'user', 'projects', 'groups', 'only_issues', 'only_milestones', 'reminder']
     extra = 1
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('memberships')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if db_field.name == 'user':
+            # the users are listed once for all rows instead of once per row
+            formfield.choices = list(formfield.choices)
+        return formfield
+
 
 class GitLabAPIAdmin(admin.ModelAdmin):
     fieldsets = [
         (None, {'fields': ['api_name', 'user', 'url']}),
         ('Token', {
             'classes': ['collapse'],
-            'fields': ['gitlab_api_token']
+            'fields': ['gitlab_api_token', 'webhook_secret']
         })
     ]
     inlines = [CalendarConfigurationInLine]
     list_display = ('api_name', 'user')
+    list_select_related = ['user']
     list_filter = ['user_id']
     search_fields = ['api_name']
 
 
 class CalendarConfigurationAdmin(admin.ModelAdmin):
+    form = CalendarConfigurationForm
     fieldsets = [
         (None, {'fields': ['config_name', 'api', 'user', 'projects', 'groups']}),
         ('Further information', {
             'classes': ['collapse'],
-            'fields': ['only_issues', 'only_milestones', 'reminder']
+            'fields': ['only_issues', 'only_milestones', 'reminder', 'max_age', 'refresh_interval']
         })
     ]
     list_display = ('config_name', 'api', 'user')
+    list_select_related = ['api', 'user']
     list_filter = ['user_id']
     search_fields = ['config_name']
 
 
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ('configuration', 'status', 'created_at', 'finished_at')
+    list_select_related = ['configuration']
+    list_filter = ['status']
+
+
+class CalendarEventAdmin(admin.ModelAdmin):
+    list_display = ('title', 'configuration', 'start')
+    list_select_related = ['configuration']
+    list_filter = ['object_type']
+    search_fields = ['title']
+
+
+class CompositeCalendarAdmin(admin.ModelAdmin):
+    list_display = ('name', 'user')
+    list_select_related = ['user']
+    list_filter = ['user_id']
+    search_fields = ['name']
+    filter_horizontal = ['members']
+
+
 admin.site.register(GitLabAPI, GitLabAPIAdmin)
 admin.site.register(CalendarConfiguration, CalendarConfigurationAdmin)
+admin.site.register(GenerationJob, GenerationJobAdmin)
+admin.site.register(CalendarEvent, CalendarEventAdmin)
+admin.site.register(CompositeCalendar, CompositeCalendarAdmin)
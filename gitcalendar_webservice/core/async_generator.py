@@ -0,0 +1,186 @@
+import asyncio
+from collections import defaultdict
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import gitlab
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from core.calendar_generator import SharedFetcher, _instance_keys, _is_visible, generator, get_categories, \
+    get_sync_cursor
+from core.throttle import throttle
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# page size of the concurrently fetched lists, the maximum GitLab allows
+PER_PAGE = 100
+REQUEST_TIMEOUT = 60
+
+TRANSPORT_ERRORS = (OSError,) if httpx is None else (OSError, httpx.TransportError)
+
+
+def create_client():
+    """
+    Returns the http client of a run, its connections are pooled for all GitLab hosts
+    """
+    if httpx is None:
+        raise ImproperlyConfigured('The asyncio generation needs httpx, install it with "pip install httpx"')
+    return httpx.AsyncClient(timeout=REQUEST_TIMEOUT, limits=httpx.Limits(
+        max_connections=None, max_keepalive_connections=settings.GITCALENDAR_ASYNC_PER_HOST))
+
+
+class AsyncGitLab:
+    """
+    Requests of one GitLab url and token. At most `limit` requests of a host are in flight, and every request takes a
+    token from the throttle of its host like the synchronous clients do.
+    """
+
+    def __init__(self, gitlab_api, client, limit):
+        self.url = gitlab_api.url.rstrip('/') + '/api/v4/'
+        self.host = urlparse(gitlab_api.url).netloc
+        self.headers = {'PRIVATE-TOKEN': gitlab_api.gitlab_api_token}
+        self._client = client
+        self._limit = limit
+
+    async def request(self, path, params=None, error=gitlab.GitlabGetError):
+        for attempt in range(settings.GITCALENDAR_THROTTLE_RETRIES + 1):
+            async with self._limit:
+                # the throttle state of a host is shared through a locked file, waiting for it must not block the loop
+                await asyncio.sleep(await sync_to_async(throttle.reserve, thread_sensitive=False)(self.host))
+                try:
+                    response = await self._client.get(self.url + path, params=params, headers=self.headers)
+                except TRANSPORT_ERRORS as err:
+                    raise gitlab.GitlabConnectionError(error_message=str(err)) from err
+            await sync_to_async(throttle.update, thread_sensitive=False)(self.host, response)
+            if response.status_code != 429:
+                break
+        if response.status_code == 401:
+            raise gitlab.GitlabAuthenticationError(response_code=401, error_message='401 Unauthorized')
+        if response.status_code != 200:
+            raise error(response_code=response.status_code, error_message=f'{response.status_code} {path}')
+        return response
+
+    @staticmethod
+    def parse(response):
+        try:
+            return response.json()
+        except ValueError as err:
+            raise gitlab.GitlabParsingError(error_message='Failed to parse the server message') from err
+
+    async def get(self, path):
+        return SimpleNamespace(**self.parse(await self.request(path)))
+
+    async def list(self, path, params):
+        """
+        Lists all pages, the pages after the first one are requested concurrently
+        """
+        params = dict(params, per_page=PER_PAGE)
+        response = await self.request(path, dict(params, page=1), gitlab.GitlabListError)
+        items = self.parse(response)
+        pages = int(response.headers.get('X-Total-Pages') or 0)
+        if pages > 1:
+            responses = await asyncio.gather(*(self.request(path, dict(params, page=page), gitlab.GitlabListError)
+                                               for page in range(2, pages + 1)))
+            for response in responses:
+                items += self.parse(response)
+        else:
+            # GitLab omits the totals of large lists, their pages are followed one by one
+            while response.headers.get('X-Next-Page'):
+                response = await self.request(path, dict(params, page=int(response.headers['X-Next-Page'])),
+                                              gitlab.GitlabListError)
+                items += self.parse(response)
+        return [SimpleNamespace(**item) for item in items]
+
+
+class PrefetchedFetcher(SharedFetcher):
+    """
+    Serves the lists, projects and groups that were fetched concurrently beforehand, anything else is requested
+    with the synchronous client. Like SharedFetcher it drops the lists once their configurations are generated.
+    """
+
+    def __init__(self, gitlab_api, since, configurations, results):
+        super().__init__(gitlab_api, since, configurations)
+        self._results = results
+
+
+def _plan(configurations):
+    """
+    Groups the configurations by GitLab url and token like share_fetches, returns the fetcher and the lists of
+    every group. The fetcher is created here, as it counts the projects and groups of its configurations.
+    """
+    grouped = defaultdict(list)
+    for configuration in configurations:
+        grouped[(configuration.api.url, configuration.api.gitlab_api_token)].append(configuration)
+
+    plans = []
+    for group in grouped.values():
+        cursors = [get_sync_cursor(configuration) for configuration in group]
+        lists = {(kind, instance_id, category) for configuration in group
+                 for kind, instance_id in _instance_keys(configuration)
+                 for category in get_categories(configuration.only_issues, configuration.only_milestones)}
+        results = {}
+        fetcher = PrefetchedFetcher(group[0].api, None if None in cursors else min(cursors), group, results)
+        plans.append((group, fetcher, results, sorted(lists)))
+    return plans
+
+
+async def _store(results, key, request):
+    try:
+        results[key] = (await request, None)
+    except gitlab.GitlabError as err:
+        results[key] = (None, err)
+
+
+async def _fetch_group(group, fetcher, results, lists, client, limit):
+    session = AsyncGitLab(group[0].api, client, limit)
+    await asyncio.gather(*(_store(results, (kind, instance_id, category), session.list(
+        f'{kind}s/{instance_id}/{category}', fetcher.filters(category))) for kind, instance_id, category in lists))
+
+    # the projects and groups that name the visible events, like fetch_instance requests them
+    instances = set()
+    for kind, instance_id, category in lists:
+        for item in results[(kind, instance_id, category)][0] or ():
+            if not _is_visible(item, category):
+                continue
+            if kind == 'group' and category == 'issues':
+                instances.add(('project', item.project_id))
+            else:
+                instances.add((kind, instance_id))
+    await asyncio.gather(*(_store(results, (kind, instance_id), session.get(f'{kind}s/{instance_id}'))
+                           for kind, instance_id in sorted(instances)))
+    return {configuration.pk: fetcher for configuration in group}
+
+
+async def aprefetch(configurations):
+    """
+    Fetches the lists of all configurations concurrently, returns a fetcher per configuration id for generator.
+    Like share_fetches every list of a GitLab url and token is only requested once.
+    """
+    plans = await sync_to_async(_plan)(configurations)
+    limits = defaultdict(lambda: asyncio.Semaphore(settings.GITCALENDAR_ASYNC_PER_HOST))
+    client = create_client()
+    try:
+        grouped = await asyncio.gather(*(
+            _fetch_group(group, fetcher, results, lists, client, limits[urlparse(group[0].api.url).netloc])
+            for group, fetcher, results, lists in plans))
+    finally:
+        await client.aclose()
+    return {pk: fetcher for fetchers in grouped for pk, fetcher in fetchers.items()}
+
+
+def prefetch(configurations):
+    return async_to_sync(aprefetch)(configurations)
+
+
+async def agenerate(configuration):
+    """
+    Generates the calendar of the configuration from async code, the events are stored and rendered in a thread
+    once all lists are fetched
+    """
+    fetchers = await aprefetch([configuration])
+    await sync_to_async(generator)(configuration, fetchers[configuration.pk])
@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class CalendarCache:
+    """
+    Bounded in-memory LRU of calendar file contents. Every entry remembers a stamp of the file it was read from
+    (mtime and size), so that files rewritten by another process are detected; the own process invalidates the
+    entries of a calendar as soon as it is generated.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self):
+        return settings.GITCALENDAR_CACHE_MAX_BYTES
+
+    @property
+    def max_entries(self):
+        return settings.GITCALENDAR_CACHE_MAX_ENTRIES
+
+    def accepts(self, size):
+        # large calendars would displace most other entries, they are streamed instead
+        return 0 < size <= self.max_bytes // 10 and self.max_entries > 0
+
+    def get(self, key, stamp):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != stamp:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, stamp, data):
+        if not self.accepts(len(data)):
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (stamp, data)
+            self._size += len(data)
+            while self._size > self.max_bytes or len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, token):
+        """
+        Drops all entries of a read token
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == str(token)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._size,
+            }
+
+    def _remove(self, key):
+        stamp, data = self._entries.pop(key)
+        self._size -= len(data)
+
+
+calendar_cache = CalendarCache()
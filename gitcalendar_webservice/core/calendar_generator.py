@@ -1,17 +1,529 @@
+import gzip
+import hashlib
+import json
+import sys
+import threading
+from collections import Counter, defaultdict
+from datetime import timedelta
+from urllib.parse import urlparse
+
 import gitlab
 from django.conf import settings
-from gitcalendar.gitcalendar import converter
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from gitcalendar.gitcalendar import NoGroupOrProjectError
+from ics import Calendar, DisplayAlarm, Event
+
+from core.calendar_cache import calendar_cache
+from core.gitlab_clients import clients
+from core.leases import generation_lease
+from core.metrics import metrics
+from core.models import CalendarEvent, CalendarMembership, EventFragment
+from core.storage import calendar_name, calendar_storage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# items that were updated while a sync was running are fetched again by the next sync
+SYNC_OVERLAP = timedelta(minutes=1)
+
+# the update time of a reused fragment is moved at most this often, it has to stay below the fragment retention
+FRAGMENT_TOUCH_INTERVAL = timedelta(days=1)
+
+# precompressed variants are written next to each calendar, so that they are not compressed on every request
+COMPRESSED_VARIANTS = {
+    '.br': brotli.compress if brotli is not None else None,
+    '.gz': lambda data: gzip.compress(data, mtime=0),
+}
+
+CALENDAR_HEADER, CALENDAR_FOOTER = Calendar().serialize().split('END:VCALENDAR')
+CALENDAR_FOOTER = 'END:VCALENDAR' + CALENDAR_FOOTER
+
+
+def get_categories(only_issues, only_milestones):
+    """
+    Returns the GitLab item types that belong into a calendar, the same way gitcalendar filters them
+    """
+    if only_issues == only_milestones:
+        return 'issues', 'milestones'
+    if only_issues:
+        return 'issues',
+    return 'milestones',
+
+
+def get_signature(configuration):
+    """
+    The stored events are only valid as long as the fetched projects, groups and item types stay the same
+    """
+    return {
+        'projects': sorted(configuration.get_project_ids() or ()),
+        'groups': sorted(configuration.get_group_ids() or ()),
+        'categories': list(get_categories(configuration.only_issues, configuration.only_milestones)),
+    }
+
+
+def get_sync_cursor(configuration):
+    """
+    Returns the time since when changes have to be fetched, or None if a full sync is needed
+    """
+    state = configuration.sync_state or {}
+    if configuration.sync_cursor is None or state.get('signature') != get_signature(configuration):
+        return None
+    # deleted items are not reported by updated_after, they vanish with the periodic full sync
+    full_synced_at = parse_datetime(state.get('full_synced_at') or '')
+    if full_synced_at is None or \
+            timezone.now() - full_synced_at > timedelta(seconds=settings.GITCALENDAR_FULL_SYNC_INTERVAL):
+        return None
+    return configuration.sync_cursor
+
+
+def store_group_paths(configuration, fetcher):
+    """
+    Stores the full paths of the groups, with which webhook events of their projects are matched. A path is
+    requested once and again with every full sync, as groups can be renamed or moved.
+    """
+    for membership in configuration.memberships.all():
+        if membership.kind != CalendarMembership.GROUP or (membership.path and fetcher.since is not None):
+            continue
+        try:
+            path = fetcher.instance('group', membership.gitlab_id).full_path
+        except gitlab.GitlabGetError:
+            continue
+        if path != membership.path:
+            CalendarMembership.objects.filter(pk=membership.pk).update(path=path)
+            membership.path = path
+
+
+def normalize_item(item, category, instance_name):
+    """
+    Converts an issue or milestone into a json serializable event, named like gitcalendar does
+    """
+    if category == 'issues':
+        title = f"{item.title} (ISSUE) [{instance_name}]"
+        if item.milestone is None:
+            description = item.description
+        else:
+            description = f"From Milestone: {item.milestone.get('title')}\n\n {item.description}"
+    else:
+        title = f"{item.title} (MILESTONE) [{instance_name}]"
+        description = item.description
+    return {
+        'type': category[:-1],
+        'id': item.id,
+        'project_id': getattr(item, 'project_id', None),
+        'title': title,
+        'start': item.due_date,
+        'description': description,
+        'url': item.web_url,
+        'updated_at': item.updated_at,
+    }
+
+
+def _is_visible(item, category):
+    if item.due_date is None:
+        return False
+    return item.state == ('opened' if category == 'issues' else 'active')
+
+
+class Fetcher:
+    """
+    Requests item lists, projects and groups from GitLab, projects and groups are only requested once per fetcher
+    """
+
+    def __init__(self, api, since=None):
+        self._api = api
+        self.since = since
+        self._instances = {}
+
+    @property
+    def api(self):
+        return self._api
+
+    def items(self, kind, instance_id, category):
+        """
+        Lists the issues or milestones of a project or group, with a cursor also closed items are listed
+        """
+        manager = self.api.projects if kind == 'project' else self.api.groups
+        instance = manager.get(instance_id, lazy=True)
+        return getattr(instance, category).list(all=True, **self.filters(category))
+
+    def filters(self, category):
+        if self.since is None:
+            return {'state': 'opened' if category == 'issues' else 'active'}
+        return {'state': 'all', 'updated_after': self.since.isoformat()}
+
+    def instance(self, kind, instance_id):
+        """
+        Returns the project or group itself, which is only needed for naming the events
+        """
+        key = (kind, instance_id)
+        if key not in self._instances:
+            manager = self.api.projects if kind == 'project' else self.api.groups
+            self._instances[key] = manager.get(instance_id)
+        return self._instances[key]
+
+    def release(self, configuration):
+        pass
+
+
+class SharedFetcher(Fetcher):
+    """
+    Shares the fetched item lists between the configurations of a batch run that use the same GitLab url and token.
+    Every list is requested once and dropped as soon as all configurations that include its project or group are
+    generated.
+    """
+
+    def __init__(self, gitlab_api, since, configurations):
+        super().__init__(None, since)
+        self._gitlab_api = gitlab_api
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._results = {}
+        self._users = Counter(key for configuration in configurations for key in _instance_keys(configuration))
+
+    @property
+    def api(self):
+        return clients.get(self._gitlab_api)
+
+    def _shared(self, key, fetch):
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._results:
+                try:
+                    self._results[key] = (fetch(), None)
+                except gitlab.GitlabError as err:
+                    self._results[key] = (None, err)
+            result, error = self._results[key]
+        if error is not None:
+            raise error
+        return result
+
+    def items(self, kind, instance_id, category):
+        return self._shared((kind, instance_id, category), lambda: super(SharedFetcher, self).items(
+            kind, instance_id, category))
+
+    def instance(self, kind, instance_id):
+        return self._shared((kind, instance_id), lambda: super(SharedFetcher, self).instance(kind, instance_id))
+
+    def release(self, configuration):
+        """
+        Drops the item lists, projects and groups that are not needed by any of the remaining configurations
+        """
+        with self._lock:
+            for kind, instance_id in _instance_keys(configuration):
+                self._users[(kind, instance_id)] -= 1
+                if self._users[(kind, instance_id)] <= 0:
+                    for key in ((kind, instance_id), (kind, instance_id, 'issues'), (kind, instance_id, 'milestones')):
+                        self._results.pop(key, None)
+                        self._locks.pop(key, None)
+            if not +self._users:
+                # the projects that only name group issues are not counted, they are dropped with the last configuration
+                self._results.clear()
+                self._locks.clear()
+
+
+def _instance_keys(configuration):
+    return [('project', pid) for pid in configuration.get_project_ids() or ()] + \
+        [('group', gid) for gid in configuration.get_group_ids() or ()]
+
+
+def share_fetches(configurations):
+    """
+    Groups the configurations by GitLab url and token, returns a shared fetcher per configuration id.
+    The data of a token is never shared with configurations of another token, as their visibility may differ.
+    A fetcher uses the oldest cursor of its configurations, so that it fetches every change that any of them needs.
+    """
+    grouped = defaultdict(list)
+    for configuration in configurations:
+        grouped[(configuration.api.url, configuration.api.gitlab_api_token)].append(configuration)
+
+    fetchers = {}
+    for group in grouped.values():
+        cursors = [get_sync_cursor(configuration) for configuration in group]
+        since = None if None in cursors else min(cursors)
+        fetcher = SharedFetcher(group[0].api, since, group)
+        for configuration in group:
+            fetchers[configuration.pk] = fetcher
+    return fetchers
+
+
+def fetch_instance(fetcher, kind, instance_id, categories, stored=None):
+    """
+    Fetches the events of a project or group. With a cursor only the items that changed since then are
+    requested and merged into the stored events, items that got closed or lost their due date are removed.
+    """
+    if stored is None or fetcher.since is None:
+        stored = {'name': None, 'events': {}}
+    else:
+        stored = {'name': stored['name'], 'events': dict(stored['events'])}
+
+    for category in categories:
+        for item in fetcher.items(kind, instance_id, category):
+            key = f"{category[:-1]}:{item.id}"
+            if not _is_visible(item, category):
+                stored['events'].pop(key, None)
+                continue
+            if kind == 'group' and category == 'issues':
+                # group issues are named after their project with its namespace
+                name = fetcher.instance('project', item.project_id).name_with_namespace
+            else:
+                if stored['name'] is None:
+                    stored['name'] = fetcher.instance(kind, instance_id).name
+                name = stored['name']
+            stored['events'][key] = normalize_item(item, category, name)
+    return stored
+
+
+def merge_instances(instances):
+    """
+    Merges the events of all projects and groups, like gitcalendar the group version of an event wins
+    """
+    events = {}
+    for key in sorted(instances, key=lambda k: k.startswith('group:')):
+        events.update(instances[key]['events'])
+    return events
+
+
+# fields of an event row that are updated when the item changed in GitLab
+EVENT_FIELDS = ['project_id', 'start', 'end', 'title', 'description', 'url', 'updated_at']
+
+
+def _event_fields(event):
+    start = parse_date(event['start'])
+    return {
+        'project_id': event['project_id'],
+        'start': start,
+        'end': start + timedelta(days=1),
+        'title': event['title'],
+        'description': event['description'] or '',
+        'url': event['url'] or '',
+        'updated_at': parse_datetime(event['updated_at']) if event['updated_at'] else None,
+    }
+
+
+def store_events(configuration, events):
+    """
+    Upserts the merged events into the event table of the configuration and deletes the ones that disappeared,
+    unchanged rows are not written
+    """
+    with transaction.atomic():
+        existing = {(row.object_type, row.object_id): row for row in configuration.events.all()}
+        created, changed = [], []
+        for event in events.values():
+            fields = _event_fields(event)
+            row = existing.pop((event['type'], event['id']), None)
+            if row is None:
+                created.append(CalendarEvent(configuration=configuration, object_type=event['type'],
+                                             object_id=event['id'], **fields))
+            elif any(getattr(row, name) != value for name, value in fields.items()):
+                for name, value in fields.items():
+                    setattr(row, name, value)
+                changed.append(row)
+        CalendarEvent.objects.bulk_create(created, batch_size=500)
+        CalendarEvent.objects.bulk_update(changed, EVENT_FIELDS, batch_size=500)
+        if existing:
+            CalendarEvent.objects.filter(pk__in=[row.pk for row in existing.values()]).delete()
+
+
+def render_event(event, reminder=0.0, uid_domain='gitcalendar'):
+    ics_event = Event(name=event.title, begin=event.start, description=event.description, location=event.url,
+                      uid=f"{event.object_type}-{event.object_id}@{uid_domain}",
+                      categories={'Issues' if event.object_type == CalendarEvent.ISSUE else 'Milestones'})
+    if reminder:
+        ics_event.alarms = [DisplayAlarm(trigger=timedelta(days=reminder))]
+    ics_event.make_all_day()
+    return ics_event.serialize()
+
+
+def render_calendar(events, reminder=0.0, uid_domain='gitcalendar'):
+    """
+    Renders the event rows, which have to be given in a stable order so that unchanged calendars result in
+    identical files
+    """
+    return CALENDAR_HEADER + ''.join(render_event(event, reminder, uid_domain) + '\r\n' for event in events) + \
+        CALENDAR_FOOTER
+
+
+def _event_order(event):
+    return event['start'], event['type'], event['id']
+
+
+def instance_fragments(instances, categories, reminder=0.0, uid_domain='gitcalendar', api_id=None):
+    """
+    Returns the rendered VEVENT blocks of every project and group. Blocks are stored per GitLab API, instance,
+    filters and reminder, only instances whose events changed since their blocks were stored are rendered again.
+    """
+    keys = {instance_key: f"{uid_domain}/{api_id}/{instance_key}/{'+'.join(categories)}/{reminder}"
+            for instance_key in instances}
+    stored = {fragment.key: fragment for fragment in EventFragment.objects.filter(key__in=keys.values())}
+    fragments = {}
+    reused = []
+    for instance_key, instance in instances.items():
+        marker = hashlib.sha256(json.dumps(instance['events'], sort_keys=True).encode('utf-8')).hexdigest()
+        fragment = stored.get(keys[instance_key])
+        if fragment is not None and fragment.marker == marker:
+            metrics.inc('gitcalendar_fragments_total', host=uid_domain, result='hit')
+            reused.append(fragment.key)
+        else:
+            metrics.inc('gitcalendar_fragments_total', host=uid_domain, result='miss')
+            blocks = {key: render_event(CalendarEvent(object_type=event['type'], object_id=event['id'],
+                                                      **_event_fields(event)), reminder, uid_domain)
+                      for key, event in instance['events'].items()}
+            fragment, _ = EventFragment.objects.update_or_create(key=keys[instance_key],
+                                                                 defaults={'marker': marker, 'blocks': blocks})
+        fragments[instance_key] = fragment.blocks
+    # reused fragments are kept from being pruned, their update time is only moved once in a while
+    now = timezone.now()
+    EventFragment.objects.filter(key__in=reused, updated_at__lt=now - FRAGMENT_TOUCH_INTERVAL).update(updated_at=now)
+    return fragments
+
+
+def prune_fragments():
+    """
+    Deletes the fragments that no generation used within GITCALENDAR_FRAGMENT_RETENTION, returns their number
+    """
+    unused_since = timezone.now() - timedelta(seconds=settings.GITCALENDAR_FRAGMENT_RETENTION)
+    return EventFragment.objects.filter(updated_at__lt=unused_since).delete()[0]
+
+
+def assemble_calendar(instances, categories, reminder=0.0, uid_domain='gitcalendar', api_id=None):
+    """
+    Concatenates the blocks of the instance fragments in the order of render_calendar, like in merge_instances
+    the group version of an event wins
+    """
+    fragments = instance_fragments(instances, categories, reminder, uid_domain, api_id)
+    winners = {}
+    for instance_key in sorted(instances, key=lambda k: k.startswith('group:')):
+        for key, event in instances[instance_key]['events'].items():
+            winners[key] = (_event_order(event), instance_key)
+    ordered = sorted(winners.items(), key=lambda item: item[1][0])
+    blocks = (fragments[instance_key][key] for key, (_, instance_key) in ordered)
+    return CALENDAR_HEADER + ''.join(block + '\r\n' for block in blocks) + CALENDAR_FOOTER
+
+
+def write_calendar_file(read_token, filename, content, previous_hash=''):
+    """
+    Saves a calendar file and its precompressed variants in the calendar storage, returns the sha256 hash of the
+    content and the number of written bytes. Unchanged calendars are not rewritten, so that their modification time
+    and ETag stay valid for the clients.
+    """
+    data = content.encode('utf-8')
+    content_hash = hashlib.sha256(data).hexdigest()
+    name = calendar_name(read_token, filename)
+    if content_hash == previous_hash and calendar_storage.exists(name):
+        return content_hash, 0
+    # the calendar comes first, variants that are older than it are not served
+    calendar_storage.save(name, ContentFile(data))
+    written = len(data)
+    for extension, compress in COMPRESSED_VARIANTS.items():
+        if compress is None:
+            # a variant of an older generation must not be served anymore
+            calendar_storage.delete(name + extension)
+            continue
+        compressed = compress(data)
+        calendar_storage.save(name + extension, ContentFile(compressed))
+        written += len(compressed)
+    calendar_cache.invalidate(read_token)
+    return content_hash, written
+
+
+def delete_calendar_file(read_token, filename):
+    """
+    Removes a calendar file and its precompressed variants from the calendar storage
+    """
+    name = calendar_name(read_token, filename)
+    for extension in ('', *COMPRESSED_VARIANTS):
+        calendar_storage.delete(name + extension)
+    calendar_cache.invalidate(read_token)
+
+
+def write_calendar(configuration, content):
+    """
+    Writes the calendar file of a configuration, returns the sha256 hash of the content
+    """
+    content_hash, written = write_calendar_file(configuration.read_token, configuration.config_name + '.ics',
+                                                content, configuration.content_hash)
+    if written:
+        metrics.inc('gitcalendar_written_bytes_total', written, host=urlparse(configuration.api.url).netloc)
+    return content_hash
+
+
+def _generate(configuration, fetcher, renew_lease=lambda: None):
+
+    project_ids = configuration.get_project_ids()
+    group_ids = configuration.get_group_ids()
+    if project_ids is None and group_ids is None:
+        raise NoGroupOrProjectError("There are no groups or projects given.")
+
+    started = timezone.now()
+    host = urlparse(configuration.api.url).netloc
+    since = get_sync_cursor(configuration)
+    # a shared fetcher can be used, as long as it does not skip changes that this configuration needs
+    if fetcher is None or (fetcher.since is not None and (since is None or fetcher.since > since)):
+        fetcher = Fetcher(clients.get(configuration.api), since)
+    state = configuration.sync_state if fetcher.since is not None else {}
+    stored_instances = state.get('instances', {})
+    categories = get_categories(configuration.only_issues, configuration.only_milestones)
+
+    instances = {}
+    full_fetcher = None
+    with metrics.timer('gitcalendar_generation_phase_seconds', host=host, phase='fetch'):
+        for kind, ids in (('project', project_ids), ('group', group_ids)):
+            for instance_id in sorted(ids or ()):
+                renew_lease()
+                key = f"{kind}:{instance_id}"
+                instance_fetcher = fetcher
+                if fetcher.since is not None and key not in stored_instances:
+                    # an instance that failed last time has no stored events the changes could be merged into
+                    if full_fetcher is None:
+                        full_fetcher = Fetcher(clients.get(configuration.api))
+                    instance_fetcher = full_fetcher
+                try:
+                    instances[key] = fetch_instance(instance_fetcher, kind, instance_id, categories,
+                                                    stored_instances.get(key))
+                except (gitlab.GitlabGetError, gitlab.GitlabListError) as err:
+                    print(f"{instance_id} is not existing or the access is denied, please check again.",
+                          err, file=sys.stderr)
+        store_group_paths(configuration, fetcher)
+
+    renew_lease()
+    events = merge_instances(instances)
+    with metrics.timer('gitcalendar_generation_phase_seconds', host=host, phase='store'):
+        store_events(configuration, events)
+    with metrics.timer('gitcalendar_generation_phase_seconds', host=host, phase='render'):
+        content = assemble_calendar(instances, categories, configuration.reminder, host, configuration.api_id)
+    with metrics.timer('gitcalendar_generation_phase_seconds', host=host, phase='write'):
+        configuration.content_hash = write_calendar(configuration, content)
+    metrics.inc('gitcalendar_generations_total', host=host)
+    metrics.inc('gitcalendar_events_total', len(events), host=host)
 
+    configuration.generated_at = started
+    configuration.sync_cursor = started - SYNC_OVERLAP
+    configuration.sync_state = {
+        'signature': get_signature(configuration),
+        'full_synced_at': (started if fetcher.since is None else parse_datetime(state['full_synced_at'])).isoformat(),
+        'instances': instances,
+    }
+    configuration.save(update_fields=['content_hash', 'generated_at', 'sync_cursor', 'sync_state'])
 
-def generator(configuration=None):
 
-    api_url = configuration.api.url
-    gitlab_api_token = configuration.api.gitlab_api_token
-    api = gitlab.Gitlab(api_url, private_token=gitlab_api_token)
-    api.auth()
-    name = configuration.config_name + '.ics'
-    path = settings.MEDIA_ROOT + "/" + str(configuration.read_token) + "/"
-    converter(api, only_issues=configuration.only_issues, only_milestones=configuration.only_milestones,
-              reminder=configuration.reminder,
-              project_ids=configuration.get_project_ids(), group_ids=configuration.get_group_ids(),
-              combined_calendar=name, target_directory_path=path)
+def generator(configuration=None, fetcher=None):
+    """
+    Generates the calendar of the configuration. It holds the generation lease of the configuration meanwhile and
+    extends it between the projects and groups, GenerationInProgress is raised if another worker or node generates it.
+    """
+    # the projects and groups are read several times per generation
+    prefetch_related_objects([configuration], 'memberships')
+    try:
+        with generation_lease(configuration) as renew_lease:
+            _generate(configuration, fetcher, renew_lease)
+    finally:
+        if fetcher is not None:
+            # the lists of a shared fetcher are dropped once every configuration that needs them is done
+            fetcher.release(configuration)
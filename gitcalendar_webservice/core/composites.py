@@ -0,0 +1,59 @@
+import re
+
+from core.calendar_generator import CALENDAR_FOOTER, CALENDAR_HEADER, write_calendar_file
+from core.models import CompositeCalendar
+from core.storage import calendar_name, calendar_storage
+
+UID_PATTERN = re.compile(r'^UID:(.*?)\r?$', re.MULTILINE)
+VEVENT_PATTERN = re.compile(r'^BEGIN:VEVENT\r?\n.*?^END:VEVENT\r?$', re.MULTILINE | re.DOTALL)
+
+
+def vevent_blocks(content):
+    """
+    Returns the VEVENT blocks of a calendar with CRLF line breaks, each block ends with its line break. The blocks
+    are searched for, so that calendars of other generators with other headers are split as well.
+    """
+    return [re.sub(r'\r?\n', '\r\n', match.group(0)) + '\r\n' for match in VEVENT_PATTERN.finditer(content)]
+
+
+def build_composite(composite, force=False):
+    """
+    Concatenates the events of the member calendars, nothing is fetched from GitLab. The file is only rebuilt
+    when the content hash of a member changed since the last build, returns whether it was rebuilt.
+    """
+    members = list(composite.members.order_by('pk').only('read_token', 'config_name', 'content_hash'))
+    member_hashes = {str(member.pk): member.content_hash for member in members}
+    if not force and composite.content_hash and member_hashes == composite.member_hashes:
+        return False
+
+    blocks = []
+    uids = set()
+    for member in members:
+        try:
+            with calendar_storage.open(calendar_name(member.read_token, member.config_name + '.ics'), 'rb') as file:
+                content = file.read().decode('utf-8')
+        except OSError:
+            continue
+        for block in vevent_blocks(content):
+            # an item shown by several members is only listed once
+            uid = UID_PATTERN.search(block)
+            if uid is not None and uid.group(1) in uids:
+                continue
+            if uid is not None:
+                uids.add(uid.group(1))
+            blocks.append(block)
+
+    composite.content_hash = write_calendar_file(composite.read_token, composite.name + '.ics',
+                                                 CALENDAR_HEADER + ''.join(blocks) + CALENDAR_FOOTER,
+                                                 composite.content_hash)[0]
+    composite.member_hashes = member_hashes
+    composite.save(update_fields=['content_hash', 'member_hashes'])
+    return True
+
+
+def rebuild_composites(configuration):
+    """
+    Rebuilds the composite calendars that include the configuration and whose member hashes changed
+    """
+    for composite in CompositeCalendar.objects.filter(members=configuration):
+        build_composite(composite)
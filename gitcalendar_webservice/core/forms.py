@@ -0,0 +1,58 @@
+from django import forms
+from django.db import transaction
+
+from core.models import CalendarConfiguration
+
+
+class CalendarConfigurationForm(forms.ModelForm):
+    """
+    Edits the projects and groups of a configuration as comma separated ids, they are saved as memberships after
+    the configuration itself
+    """
+    projects = forms.CharField(label="Project list", required=False)
+    groups = forms.CharField(label="Group list", required=False)
+
+    class Meta:
+        model = CalendarConfiguration
+        fields = [
+            'config_name', 'api', 'projects', 'groups', 'only_issues', 'only_milestones', 'max_age',
+            'refresh_interval'
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is not None:
+            self.initial.setdefault('projects', self.instance.projects)
+            self.initial.setdefault('groups', self.instance.groups)
+
+    def clean_projects(self):
+        return CalendarConfiguration._convert_ids(self.cleaned_data['projects'].strip())
+
+    def clean_groups(self):
+        return CalendarConfiguration._convert_ids(self.cleaned_data['groups'].strip())
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('projects') and not cleaned_data.get('groups'):
+            raise forms.ValidationError({'projects': "Please provide an entry for at least one project/group",
+                                         'groups': "Please provide an entry for at least one project/group"})
+        return cleaned_data
+
+    @transaction.atomic
+    def save(self, commit=True):
+        configuration = super().save(commit)
+        if commit:
+            self.save_memberships()
+        else:
+            # like many-to-many fields the memberships are saved by save_m2m once the configuration is saved
+            save_m2m = self.save_m2m
+
+            def save_all():
+                save_m2m()
+                self.save_memberships()
+            self.save_m2m = save_all
+        return configuration
+
+    def save_memberships(self):
+        self.instance.set_project_ids(self.cleaned_data['projects'])
+        self.instance.set_group_ids(self.cleaned_data['groups'])
@@ -0,0 +1,80 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+import gitlab
+import requests
+from django.conf import settings
+
+from core.metrics import metrics
+from core.throttle import ThrottledAdapter
+
+
+class _ClientEntry:
+    def __init__(self, api):
+        self.api = api
+        self.lock = threading.Lock()
+        self.authenticated_at = None
+
+
+class GitLabClientRegistry:
+    """
+    Keeps one authenticated python-gitlab client per GitLabAPI, so that subsequent generations
+    reuse the keep-alive connections and skip the authentication round-trip.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._keys = {}
+
+    @staticmethod
+    def _create_session():
+        session = requests.Session()
+        adapter = ThrottledAdapter(pool_connections=1, pool_maxsize=settings.GITCALENDAR_CLIENT_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def get(self, gitlab_api):
+        """
+        Returns the client of the given GitLabAPI, the authentication is repeated once its ttl expired
+        """
+        key = (gitlab_api.url, gitlab_api.gitlab_api_token)
+        with self._lock:
+            if self._keys.get(gitlab_api.pk, key) != key:
+                self._clients.pop(self._keys[gitlab_api.pk], None)
+            self._keys[gitlab_api.pk] = key
+            entry = self._clients.get(key)
+            if entry is None:
+                api = gitlab.Gitlab(gitlab_api.url, private_token=gitlab_api.gitlab_api_token,
+                                    session=self._create_session())
+                entry = self._clients[key] = _ClientEntry(api)
+        with entry.lock:
+            if entry.authenticated_at is None or \
+                    time.monotonic() - entry.authenticated_at > settings.GITCALENDAR_CLIENT_AUTH_TTL:
+                with metrics.timer('gitcalendar_generation_phase_seconds', host=urlparse(gitlab_api.url).netloc,
+                                   phase='auth'):
+                    entry.api.auth()
+                entry.authenticated_at = time.monotonic()
+        return entry.api
+
+    def discard(self, gitlab_api):
+        """
+        Drops the client of the given GitLabAPI and closes its connections
+        """
+        with self._lock:
+            entry = self._clients.pop(self._keys.pop(gitlab_api.pk, None), None)
+        if entry is not None:
+            entry.api.session.close()
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._clients.values())
+            self._clients.clear()
+            self._keys.clear()
+        for entry in entries:
+            entry.api.session.close()
+
+
+clients = GitLabClientRegistry()
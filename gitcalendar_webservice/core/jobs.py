@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from gitlab import GitlabAuthenticationError, GitlabGetError
+
+from core.calendar_generator import generator
+from core.leases import GenerationInProgress
+from core.models import CalendarConfiguration, GenerationJob
+
+
+# a debounced job is postponed by further triggers, but at most by this multiple of the delay after its creation
+DEBOUNCE_MAX_FACTOR = 5
+
+
+# serializes the enqueues of this process, the row lock of the configuration those of other processes
+_enqueue_lock = threading.Lock()
+
+
+def enqueue_generation(configuration, delay=None, join_running=False):
+    """
+    Queues a generation of the configuration, an already queued job is reused instead of adding another one.
+    The database allows one queued job per configuration, a job that another process queued meanwhile is reused.
+    With a delay (seconds) the job is debounced: it runs once no further trigger arrived within the delay.
+    With join_running a job that is running at the moment is returned as well, so concurrent requests share
+    one generation and its result.
+    """
+    now = timezone.now()
+    run_after = now if not delay else now + timedelta(seconds=delay)
+    with _enqueue_lock, transaction.atomic():
+        CalendarConfiguration.objects.select_for_update().only('pk').get(pk=configuration.pk)
+        if join_running:
+            job = configuration.jobs.filter(alive_jobs()).first()
+            if job is not None:
+                return job
+        job = configuration.jobs.filter(status=GenerationJob.QUEUED).first()
+        if job is None:
+            try:
+                with transaction.atomic():
+                    return GenerationJob.objects.create(configuration=configuration, run_after=run_after)
+            except IntegrityError:
+                job = configuration.jobs.get(status=GenerationJob.QUEUED)
+        if delay:
+            run_after = min(max(job.run_after, run_after),
+                            job.created_at + timedelta(seconds=delay * DEBOUNCE_MAX_FACTOR))
+        if run_after != job.run_after:
+            job.run_after = run_after
+            job.save(update_fields=['run_after'])
+    return job
+
+
+# a job whose calendar is generated on another node at the moment is retried after this many seconds
+LEASE_RETRY_DELAY = 30
+
+
+# a burst of reads of the same calendar only looks for a needed refresh once within this interval (seconds)
+STALE_CHECK_INTERVAL = 60
+# read tokens by the time of their last check, oldest first. Expired checks are dropped, so the dict stays bounded.
+_stale_checks = OrderedDict()
+_stale_checks_lock = threading.Lock()
+
+
+def refresh_if_stale(read_token):
+    """
+    Queues a generation if the calendar is older than the maximum age of its configuration.
+    Returns the job, or None if no refresh is needed or one is already pending.
+    """
+    now = time.monotonic()
+    with _stale_checks_lock:
+        while _stale_checks and now - next(iter(_stale_checks.values())) >= STALE_CHECK_INTERVAL:
+            _stale_checks.popitem(last=False)
+        if read_token in _stale_checks:
+            return None
+        _stale_checks[read_token] = now
+
+    configuration = CalendarConfiguration.objects.filter(read_token=read_token, max_age__isnull=False).first()
+    if configuration is None:
+        return None
+    # unchanged calendars are not rewritten, so the age is given by the generation time instead of the file
+    generated_at = configuration.generated_at
+    if generated_at is not None and timezone.now() - generated_at <= timedelta(minutes=configuration.max_age):
+        return None
+    if configuration.jobs.filter(Q(status=GenerationJob.QUEUED) | alive_jobs()).exists():
+        return None
+    return enqueue_generation(configuration)
+
+
+def alive_jobs():
+    """
+    Returns the condition of running jobs whose worker is alive: they started within the generation lease or their
+    configuration is still leased. Other running jobs belong to a crashed worker.
+    """
+    now = timezone.now()
+    return Q(status=GenerationJob.RUNNING) & (
+        Q(started_at__gt=now - timedelta(seconds=settings.GITCALENDAR_GENERATION_LEASE))
+        | Q(configuration__lease_expires_at__gt=now))
+
+
+def reap_stale_jobs():
+    """
+    Marks the running jobs of crashed workers as failed, returns their number
+    """
+    return GenerationJob.objects.filter(status=GenerationJob.RUNNING).exclude(alive_jobs()) \
+        .update(status=GenerationJob.FAILED, error='The worker stopped during the generation',
+                finished_at=timezone.now())
+
+
+def claim_next_job():
+    """
+    Marks the longest due queued job as running and returns it, the update only succeeds for one of several workers
+    """
+    reap_stale_jobs()
+    while True:
+        job = GenerationJob.objects.filter(status=GenerationJob.QUEUED, run_after__lte=timezone.now()) \
+            .order_by('run_after', 'pk').first()
+        if job is None:
+            return None
+        claimed = GenerationJob.objects.filter(pk=job.pk, status=GenerationJob.QUEUED) \
+            .update(status=GenerationJob.RUNNING, started_at=timezone.now())
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def run_job(job):
+    """
+    Generates the calendar of a claimed job and stores the outcome
+    """
+    try:
+        generator(job.configuration)
+    except GenerationInProgress:
+        retry_at = timezone.now() + timedelta(seconds=LEASE_RETRY_DELAY)
+        try:
+            with transaction.atomic():
+                GenerationJob.objects.filter(pk=job.pk).update(status=GenerationJob.QUEUED, started_at=None,
+                                                               run_after=retry_at)
+            job.refresh_from_db()
+            return job
+        except IntegrityError:
+            # a trigger queued another job meanwhile, the retry is merged into it
+            queued = job.configuration.jobs.get(status=GenerationJob.QUEUED)
+            GenerationJob.objects.filter(pk=queued.pk, run_after__gt=retry_at).update(run_after=retry_at)
+            job.error = f'Merged into the queued job {queued.pk}, the calendar was generated elsewhere'
+    except GitlabGetError:
+        job.error = 'GitLab request failed'
+    except GitlabAuthenticationError:
+        job.error = 'GitLab Authentication failed'
+    except Exception as e:
+        job.error = str(e) or e.__class__.__name__
+    job.status = GenerationJob.FAILED if job.error else GenerationJob.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    if job.status == GenerationJob.DONE:
+        CalendarConfiguration.objects.filter(pk=job.configuration_id).update(file_exists=True)
+    return job
+
+
+def run_pending_jobs():
+    """
+    Drains the queue, returns the number of processed jobs
+    """
+    count = 0
+    job = claim_next_job()
+    while job is not None:
+        run_job(job)
+        count += 1
+        job = claim_next_job()
+    return count
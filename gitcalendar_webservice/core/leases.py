@@ -0,0 +1,63 @@
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import CalendarConfiguration
+
+
+class GenerationInProgress(Exception):
+    """
+    The calendar is generated by another worker or node at the moment
+    """
+
+
+def lease_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def acquire_lease(configuration, owner):
+    """
+    Takes the generation lease of the configuration, the update only succeeds if the lease is free or expired
+    """
+    now = timezone.now()
+    return bool(CalendarConfiguration.objects.filter(pk=configuration.pk).filter(
+        Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now) | Q(lease_owner=owner)
+    ).update(lease_owner=owner, lease_expires_at=now + timedelta(seconds=settings.GITCALENDAR_GENERATION_LEASE)))
+
+
+def release_lease(configuration, owner):
+    CalendarConfiguration.objects.filter(pk=configuration.pk, lease_owner=owner) \
+        .update(lease_owner='', lease_expires_at=None)
+
+
+@contextmanager
+def generation_lease(configuration):
+    """
+    Holds the generation lease of the configuration, raises GenerationInProgress if another owner holds it.
+    A lease of a crashed node expires after GITCALENDAR_GENERATION_LEASE seconds. Long generations call the
+    yielded function regularly, it extends the lease once half of it has passed.
+    """
+    owner = lease_owner()
+    if not acquire_lease(configuration, owner):
+        raise GenerationInProgress(f"Calendar Configuration \"{configuration}\" is generated elsewhere")
+    renewed = time.monotonic()
+
+    def renew():
+        nonlocal renewed
+        if time.monotonic() - renewed < settings.GITCALENDAR_GENERATION_LEASE / 2:
+            return
+        if not acquire_lease(configuration, owner):
+            raise GenerationInProgress(f"The lease of Calendar Configuration \"{configuration}\" was taken over")
+        renewed = time.monotonic()
+
+    try:
+        yield renew
+    finally:
+        release_lease(configuration, owner)
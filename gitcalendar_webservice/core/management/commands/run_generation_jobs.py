@@ -0,0 +1,46 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from core.jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = 'Generates the calendars of queued generation jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of jobs that are processed at the same time')
+        parser.add_argument('--poll', type=float, default=5.0,
+                            help='Seconds to wait before looking for new jobs once the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit as soon as the queue is empty')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('--workers has to be at least 1')
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                if workers == 1:
+                    processed = self._drain(0)
+                else:
+                    processed = sum(executor.map(self._drain, range(workers)))
+                if processed:
+                    self.stdout.write(self.style.SUCCESS('Processed %d generation jobs' % processed))
+                if options['once']:
+                    break
+                time.sleep(options['poll'])
+
+    @staticmethod
+    def _drain(worker):
+        """
+        Processes jobs until the queue is empty, then drops the database connection if it broke or became too old
+        """
+        try:
+            return run_pending_jobs()
+        finally:
+            close_old_connections()
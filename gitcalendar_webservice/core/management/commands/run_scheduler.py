@@ -0,0 +1,84 @@
+import heapq
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from core.jobs import enqueue_generation
+from core.models import CalendarConfiguration
+
+
+def next_refresh(now, interval, jitter):
+    """
+    Returns the next due time, the interval in minutes is varied by the jitter fraction to spread the load
+    """
+    return now + timedelta(minutes=interval * (1 + random.uniform(-jitter, jitter)))
+
+
+class Command(BaseCommand):
+    help = 'Queues calendar generations according to the refresh interval of each configuration, ' \
+           'the jobs are processed by run_generation_jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jitter', type=float, default=0.1,
+                            help='Fraction by which each refresh interval is randomly varied')
+        parser.add_argument('--reload', type=float, default=60.0,
+                            help='Seconds after which new and changed configurations are loaded')
+        parser.add_argument('--once', action='store_true',
+                            help='Queue the due configurations and exit')
+
+    def handle(self, *args, **options):
+        jitter = options['jitter']
+        if not 0 <= jitter < 1:
+            raise CommandError('--jitter has to be at least 0 and less than 1')
+
+        while True:
+            queue = self._load()
+            reload_at = time.monotonic() + options['reload']
+            while time.monotonic() < reload_at:
+                self._queue_due(queue, jitter)
+                if options['once']:
+                    return
+                close_old_connections()
+                wait = reload_at - time.monotonic()
+                if queue:
+                    wait = min(wait, (queue[0][0] - timezone.now()).total_seconds())
+                time.sleep(max(wait, 0.1))
+
+    @staticmethod
+    def _load():
+        """
+        Builds the priority queue of due times. Configurations without a persisted due time are spread over their
+        first interval, so that neither the first start nor a restart refreshes everything at once.
+        """
+        now = timezone.now()
+        queue = []
+        for config in CalendarConfiguration.objects.filter(refresh_interval__isnull=False).only(
+                'refresh_interval', 'next_refresh_at'):
+            if config.next_refresh_at is None:
+                config.next_refresh_at = now + timedelta(minutes=config.refresh_interval * random.random())
+                CalendarConfiguration.objects.filter(pk=config.pk).update(next_refresh_at=config.next_refresh_at)
+            queue.append((config.next_refresh_at, config.pk))
+        heapq.heapify(queue)
+        return queue
+
+    def _queue_due(self, queue, jitter):
+        now = timezone.now()
+        rescheduled = []
+        # every due configuration is queued at most once per pass, even if its next due time is not after now
+        while queue and queue[0][0] <= now:
+            due, pk = heapq.heappop(queue)
+            config = CalendarConfiguration.objects.filter(pk=pk, refresh_interval__isnull=False).first()
+            if config is None or config.next_refresh_at != due:
+                # deleted, unscheduled or rescheduled since the queue was loaded
+                continue
+            enqueue_generation(config)
+            config.next_refresh_at = next_refresh(now, max(config.refresh_interval, 1), jitter)
+            CalendarConfiguration.objects.filter(pk=pk).update(next_refresh_at=config.next_refresh_at)
+            rescheduled.append((config.next_refresh_at, pk))
+            self.stdout.write('Queued "%s"' % config.config_name)
+        for entry in rescheduled:
+            heapq.heappush(queue, entry)
@@ -1,21 +1,97 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+from django.core.exceptions import ImproperlyConfigured
 from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
 
-from core.calendar_generator import generator
+from core.async_generator import prefetch
+from core.calendar_generator import generator, prune_fragments, share_fetches
+from core.leases import GenerationInProgress
 from core.models import CalendarConfiguration
 
 
 class Command(BaseCommand):
     help = 'Updates all calendars'
 
-    #  def add_arguments(self, parser):
-    #     parser.add_argument('poll_ids', nargs='+', type=int)
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of calendars that are generated at the same time')
+        parser.add_argument('--per-host', type=int, default=4,
+                            help='Maximum number of simultaneous generations against one GitLab host')
+        parser.add_argument('--asyncio', action='store_true',
+                            help='Fetches the lists of all calendars concurrently before generating them, needs httpx')
 
     def handle(self, *args, **options):
-        for config in CalendarConfiguration.objects.all():
-            print(config.config_name)
+        workers = options['workers']
+        per_host = options['per_host']
+        if workers < 1 or per_host < 1:
+            raise CommandError('--workers and --per-host have to be at least 1')
+
+        configs = list(CalendarConfiguration.objects.select_related('api').prefetch_related('memberships'))
+        # caps the number of generations that hit the same GitLab host at once
+        host_limits = {self._host(config): threading.BoundedSemaphore(per_host) for config in configs}
+        # projects and groups are fetched once per token and shared by all of its configurations
+        if options['asyncio']:
+            try:
+                fetchers = prefetch(configs)
+            except ImproperlyConfigured as e:
+                raise CommandError(str(e))
+        else:
+            fetchers = share_fetches(configs)
+
+        failed = []
+        if workers == 1:
+            results = ((config, self._generate(config, fetchers[config.pk])) for config in configs)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+            futures = {executor.submit(self._generate_threaded, config, fetchers[config.pk],
+                                       host_limits[self._host(config)]): config
+                       for config in configs}
+            results = ((futures[future], future.result()) for future in as_completed(futures))
+
+        for config, error in results:
+            if error is None:
+                CalendarConfiguration.objects.filter(pk=config.pk).update(file_exists=True)
+                self.stdout.write(self.style.SUCCESS('Successfully updated "%s"' % config.config_name))
+            elif isinstance(error, GenerationInProgress):
+                self.stdout.write(self.style.WARNING('Skipped "%s", it is generated elsewhere' % config.config_name))
+            else:
+                failed.append(config)
+                self.stderr.write(self.style.ERROR('Calendar Configuration "%s" failed: %s'
+                                                   % (config.config_name, error)))
+        if workers > 1:
+            executor.shutdown()
+
+        pruned = prune_fragments()
+        if pruned:
+            self.stdout.write('Removed %d unused event fragments' % pruned)
+
+        if failed:
+            names = ', '.join('"%s"' % config.config_name for config in failed)
+            raise CommandError('%d of %d calendar configurations failed: %s' % (len(failed), len(configs), names))
+        self.stdout.write(self.style.SUCCESS('Successfully updated %d calendar configurations' % len(configs)))
+
+    @staticmethod
+    def _host(config):
+        return urlparse(config.api.url).netloc
+
+    def _generate_threaded(self, config, fetcher, host_limit):
+        with host_limit:
             try:
-                generator(config)
-            except Exception:
-                self.stdout.write(self.style.ERROR('Calendar Configuration "%s" failed' % config.config_name))
+                return self._generate(config, fetcher)
+            finally:
+                # every worker thread holds its own database connection
+                close_old_connections()
 
-            self.stdout.write(self.style.SUCCESS('Successfully updated "%s"' % config.config_name))
+    @staticmethod
+    def _generate(config, fetcher):
+        """
+        Generates a single calendar, returns the raised exception or None on success
+        """
+        try:
+            generator(config, fetcher)
+        except Exception as e:
+            return e
+        return None
@@ -0,0 +1,136 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+from core.calendar_cache import calendar_cache
+from core.throttle import throttle
+
+# upper bounds of the duration histograms in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+METRICS = {
+    'gitcalendar_generation_phase_seconds': (
+        'histogram', 'Duration of the generation phases auth, fetch, store, render and write'),
+    'gitcalendar_generations_total': ('counter', 'Generated calendars'),
+    'gitcalendar_events_total': ('counter', 'Events written to calendars'),
+    'gitcalendar_fragments_total': (
+        'counter', 'Fragments of projects and groups that were reused (hit) or rendered (miss)'),
+    'gitcalendar_written_bytes_total': ('counter', 'Bytes of calendar files and their compressed variants'),
+    'gitcalendar_calendar_response_seconds': ('histogram', 'Duration of calendar downloads'),
+}
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms of this process, rendered in the Prometheus text format. Every process keeps its own
+    values, so each of them has to be scraped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        if name not in METRICS:
+            raise KeyError(f"Unknown metric {name}")
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.setdefault(key, [0] * len(DURATION_BUCKETS) + [0.0, 0])
+            index = bisect_left(DURATION_BUCKETS, value)
+            if index < len(DURATION_BUCKETS):
+                histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _samples(self, name):
+        """
+        Returns the samples of a metric as (suffix, labels, value)
+        """
+        with self._lock:
+            counters = [(key, value) for key, value in self._counters.items() if key[0] == name]
+            histograms = [(key, list(value)) for key, value in self._histograms.items() if key[0] == name]
+        samples = []
+        for (_, labels), value in sorted(counters):
+            samples.append(('', dict(labels), value))
+        for (_, labels), histogram in sorted(histograms):
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, histogram):
+                cumulative += count
+                samples.append(('_bucket', dict(labels, le=_format_value(bound)), cumulative))
+            samples.append(('_bucket', dict(labels, le='+Inf'), histogram[-1]))
+            samples.append(('_sum', dict(labels), histogram[-2]))
+            samples.append(('_count', dict(labels), histogram[-1]))
+        return samples
+
+    def collect(self):
+        """
+        Returns all metric families as (name, type, help, samples), including the throttle and cache statistics
+        """
+        families = [(name, kind, help_text, self._samples(name)) for name, (kind, help_text) in METRICS.items()]
+        hosts = sorted(throttle.stats().items())
+        for field, kind, help_text in (
+                ('requests', 'counter', 'Requests sent to a GitLab host'),
+                ('throttled_seconds', 'counter', 'Seconds waited for the rate limit of a GitLab host'),
+                ('throttled_requests', 'counter', 'Requests that waited for the rate limit of a GitLab host'),
+                ('rate_limited_responses', 'counter', 'Responses of a GitLab host with status 429')):
+            samples = [('', {'host': host}, stats[field]) for host, stats in hosts]
+            families.append((f'gitcalendar_gitlab_{field}_total', kind, help_text, samples))
+        cache = calendar_cache.stats()
+        for field, kind, help_text in (
+                ('hits', 'counter', 'Calendar downloads served from the in-memory cache'),
+                ('misses', 'counter', 'Calendar downloads that were not in the in-memory cache'),
+                ('evictions', 'counter', 'Calendars evicted from the in-memory cache'),
+                ('entries', 'gauge', 'Calendars in the in-memory cache'),
+                ('bytes', 'gauge', 'Size of the calendars in the in-memory cache')):
+            name = f'gitcalendar_calendar_cache_{field}' + ('_total' if kind == 'counter' else '')
+            families.append((name, kind, help_text, [('', {}, cache[field])]))
+        return families
+
+    def render(self):
+        lines = []
+        for name, kind, help_text, samples in self.collect():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for suffix, labels, value in samples:
+                lines.append(f'{name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendarconfiguration',
+            name='sync_cursor',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='calendarconfiguration',
+            name='sync_state',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
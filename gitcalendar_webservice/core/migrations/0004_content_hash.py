@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_generationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendarconfiguration',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendarconfiguration',
+            name='max_age',
+            field=models.PositiveIntegerField(blank=True, help_text='Reading an older calendar triggers its regeneration', null=True, verbose_name='Maximum age in minutes'),
+        ),
+    ]
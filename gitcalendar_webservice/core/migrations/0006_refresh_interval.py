@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:12
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_max_age'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendarconfiguration',
+            name='next_refresh_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='calendarconfiguration',
+            name='refresh_interval',
+            field=models.PositiveIntegerField(blank=True, help_text='Regenerated periodically by the scheduler', null=True, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Refresh interval in minutes'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:13
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_refresh_interval'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='run_after',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='gitlabapi',
+            name='webhook_secret',
+            field=models.CharField(blank=True, default='', help_text='Secret token of the GitLab webhooks that trigger regenerations', max_length=100, verbose_name='Webhook secret token'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_webhooks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendarconfiguration',
+            name='generated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_generated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_type', models.CharField(choices=[('issue', 'Issue'), ('milestone', 'Milestone')], max_length=10)),
+                ('object_id', models.IntegerField()),
+                ('project_id', models.IntegerField(blank=True, null=True)),
+                ('start', models.DateField()),
+                ('end', models.DateField()),
+                ('title', models.TextField()),
+                ('description', models.TextField(blank=True, default='')),
+                ('url', models.URLField(blank=True, default='', max_length=500)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('configuration', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='core.calendarconfiguration')),
+            ],
+            options={
+                'ordering': ['start', 'object_type', 'object_id'],
+                'indexes': [models.Index(fields=['configuration', 'start'], name='core_calend_configu_f568a7_idx'), models.Index(fields=['project_id'], name='core_calend_project_5404f1_idx')],
+                'constraints': [models.UniqueConstraint(fields=('configuration', 'object_type', 'object_id'), name='unique_calendar_event')],
+            },
+        ),
+    ]
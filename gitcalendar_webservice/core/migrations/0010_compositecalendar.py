@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:32
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_calendarevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompositeCalendar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('read_token', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('content_hash', models.CharField(blank=True, default='', editable=False, max_length=64)),
+                ('member_hashes', models.JSONField(blank=True, default=dict, editable=False)),
+                ('members', models.ManyToManyField(related_name='composites', to='core.calendarconfiguration')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='composite_calendars', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_eventfragment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendarconfiguration',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='calendarconfiguration',
+            name='lease_owner',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.migrations.exceptions import IrreversibleError
+
+# max_length of the removed projects and groups fields
+ID_LIST_LENGTH = 100
+
+
+def _ids(id_string):
+    ids = set()
+    for gitlab_id in id_string.split(','):
+        try:
+            ids.add(int(gitlab_id))
+        except ValueError:
+            pass
+    return ids
+
+
+def copy_id_lists(apps, schema_editor):
+    """
+    Creates the memberships of the comma separated project and group lists, invalid ids are dropped
+    """
+    CalendarConfiguration = apps.get_model('core', 'CalendarConfiguration')
+    CalendarMembership = apps.get_model('core', 'CalendarMembership')
+    memberships = []
+    for configuration in CalendarConfiguration.objects.only('pk', 'projects', 'groups').iterator():
+        for kind, id_string in (('project', configuration.projects), ('group', configuration.groups)):
+            memberships += [CalendarMembership(configuration_id=configuration.pk, kind=kind, gitlab_id=gitlab_id)
+                            for gitlab_id in sorted(_ids(id_string))]
+    CalendarMembership.objects.bulk_create(memberships, batch_size=500)
+
+
+def restore_id_lists(apps, schema_editor):
+    """
+    Joins the memberships into the comma separated lists, which fails if a list does not fit into its field
+    """
+    CalendarConfiguration = apps.get_model('core', 'CalendarConfiguration')
+    CalendarMembership = apps.get_model('core', 'CalendarMembership')
+    ids = {}
+    for membership in CalendarMembership.objects.order_by('gitlab_id').iterator():
+        ids.setdefault((membership.configuration_id, membership.kind), []).append(str(membership.gitlab_id))
+    lists = {key: ','.join(gitlab_ids) for key, gitlab_ids in ids.items()}
+    for (configuration_id, kind), id_list in lists.items():
+        if len(id_list) > ID_LIST_LENGTH:
+            raise IrreversibleError(f"The {kind}s of calendar configuration {configuration_id} do not fit into "
+                                    f"{ID_LIST_LENGTH} characters, remove some of them before migrating back")
+    for configuration in CalendarConfiguration.objects.only('pk').iterator():
+        configuration.projects = lists.get((configuration.pk, 'project'), '')
+        configuration.groups = lists.get((configuration.pk, 'group'), '')
+        configuration.save(update_fields=['projects', 'groups'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_generation_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('project', 'Project'), ('group', 'Group')], max_length=10)),
+                ('gitlab_id', models.BigIntegerField()),
+                ('path', models.CharField(blank=True, default='', max_length=255)),
+                ('configuration', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='core.calendarconfiguration')),
+            ],
+            options={
+                'ordering': ['configuration', 'kind', 'gitlab_id'],
+                'indexes': [models.Index(fields=['kind', 'gitlab_id'], name='core_calend_kind_22e5d9_idx'), models.Index(fields=['kind', 'path'], name='core_calend_kind_d6ae36_idx')],
+                'constraints': [models.UniqueConstraint(fields=('configuration', 'kind', 'gitlab_id'), name='unique_calendar_membership')],
+            },
+        ),
+        migrations.RunPython(copy_id_lists, restore_id_lists),
+        migrations.RemoveField(
+            model_name='calendarconfiguration',
+            name='groups',
+        ),
+        migrations.RemoveField(
+            model_name='calendarconfiguration',
+            name='projects',
+        ),
+    ]
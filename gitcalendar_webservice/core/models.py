@@ -2,8 +2,9 @@ import sys
 import uuid
 
 from django.conf import global_settings
-from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.validators import MinValueValidator
+from django.db import models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 
@@ -13,6 +14,8 @@ class GitLabAPI(models.Model):
     api_name = models.CharField(max_length=100, blank=False, null=False)
     url = models.URLField(blank=False, null=False)
     gitlab_api_token = models.CharField(max_length=100, blank=False, null=False)
+    webhook_secret = models.CharField(verbose_name="Webhook secret token", max_length=100, default='', blank=True,
+                                      help_text="Secret token of the GitLab webhooks that trigger regenerations")
 
     def __str__(self):
         return self.api_name
@@ -26,13 +29,25 @@ class CalendarConfiguration(models.Model):
     user = models.ForeignKey(global_settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="cal_users")
     read_token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     write_token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
-    projects = models.CharField(verbose_name="Project list", max_length=100, default='', blank=True, null=False)
-    groups = models.CharField(verbose_name="Group list", max_length=100, default='', blank=True, null=False)
     config_name = models.CharField(max_length=100)
     only_issues = models.BooleanField(verbose_name="Only issues", default=False)
     only_milestones = models.BooleanField(verbose_name="Only milestones", default=False)
     reminder = models.FloatField(verbose_name="Reminder", default=0.0)
+    max_age = models.PositiveIntegerField(verbose_name="Maximum age in minutes", null=True, blank=True,
+                                          help_text="Reading an older calendar triggers its regeneration")
+    refresh_interval = models.PositiveIntegerField(verbose_name="Refresh interval in minutes", null=True, blank=True,
+                                                   validators=[MinValueValidator(1)],
+                                                   help_text="Regenerated periodically by the scheduler")
+    next_refresh_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
     file_exists = models.BooleanField(default=False, editable=False)
+    content_hash = models.CharField(max_length=64, default='', blank=True, editable=False)
+    generated_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # held by the worker that generates the calendar, see core.leases
+    lease_owner = models.CharField(max_length=255, default='', blank=True, editable=False)
+    lease_expires_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # changes since the cursor are merged into the events of the previous generation
+    sync_cursor = models.DateTimeField(null=True, blank=True, editable=False)
+    sync_state = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return self.config_name
@@ -41,11 +56,6 @@ class CalendarConfiguration(models.Model):
     def get_related():
         return None
 
-    def clean(self):
-        if self.projects == '' and self.groups == '':
-            raise ValidationError({'projects': "Please provide an entry for at least one project/group",
-                                   'groups': "Please provide an entry for at least one project/group"})
-
     @staticmethod
     def _convert_ids(id_string):
         """
@@ -62,8 +72,195 @@ class CalendarConfiguration(models.Model):
         else:
             return None
 
+    def _member_ids(self, kind):
+        """
+        Returns the ids of the projects or groups, or None if there are none
+        """
+        if self.pk is None:
+            return None
+        # iterates all memberships, so that a prefetch_related('memberships') is used
+        return {membership.gitlab_id for membership in self.memberships.all() if membership.kind == kind} or None
+
+    @transaction.atomic
+    def _set_member_ids(self, kind, ids):
+        if isinstance(ids, str):
+            ids = self._convert_ids(ids.strip())
+        ids = set(ids or ())
+        # the kept rows keep the paths that the generator stored
+        self.memberships.filter(kind=kind).exclude(gitlab_id__in=ids).delete()
+        existing = set(self.memberships.filter(kind=kind).values_list('gitlab_id', flat=True))
+        CalendarMembership.objects.bulk_create(CalendarMembership(configuration=self, kind=kind, gitlab_id=gitlab_id)
+                                               for gitlab_id in sorted(ids - existing))
+        getattr(self, '_prefetched_objects_cache', {}).pop('memberships', None)
+
     def get_project_ids(self):
-        return self._convert_ids(self.projects)
+        return self._member_ids(CalendarMembership.PROJECT)
 
     def get_group_ids(self):
-        return self._convert_ids(self.groups)
+        return self._member_ids(CalendarMembership.GROUP)
+
+    def set_project_ids(self, ids):
+        """
+        Stores the projects of the saved configuration, given as ids or as a comma separated string
+        """
+        self._set_member_ids(CalendarMembership.PROJECT, ids)
+
+    def set_group_ids(self, ids):
+        """
+        Stores the groups of the saved configuration, given as ids or as a comma separated string
+        """
+        self._set_member_ids(CalendarMembership.GROUP, ids)
+
+    @property
+    def projects(self):
+        """
+        Comma separated project ids
+        """
+        return ','.join(str(pid) for pid in sorted(self.get_project_ids() or ()))
+
+    @property
+    def groups(self):
+        """
+        Comma separated group ids
+        """
+        return ','.join(str(gid) for gid in sorted(self.get_group_ids() or ()))
+
+    def latest_job(self):
+        return self.jobs.first()
+
+
+class CalendarMembership(models.Model):
+    """
+    Project or group shown by a configuration, indexed for finding the configurations of a project or group.
+    The full path of a group is stored by the generator, so that projects can be matched by their namespace.
+    """
+    PROJECT = 'project'
+    GROUP = 'group'
+    KIND_CHOICES = [
+        (PROJECT, 'Project'),
+        (GROUP, 'Group'),
+    ]
+
+    configuration = models.ForeignKey(CalendarConfiguration, on_delete=models.CASCADE, related_name="memberships")
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    gitlab_id = models.BigIntegerField()
+    path = models.CharField(max_length=255, default='', blank=True)
+
+    class Meta:
+        ordering = ['configuration', 'kind', 'gitlab_id']
+        constraints = [
+            models.UniqueConstraint(fields=['configuration', 'kind', 'gitlab_id'], name='unique_calendar_membership'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'gitlab_id']),
+            models.Index(fields=['kind', 'path']),
+        ]
+
+    def __str__(self):
+        return f"{self.configuration} ({self.kind} {self.gitlab_id})"
+
+
+class GenerationJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    configuration = models.ForeignKey(CalendarConfiguration, on_delete=models.CASCADE, related_name="jobs")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    error = models.TextField(default='', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(default=timezone.now, db_index=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at', '-pk']
+        constraints = [
+            # triggers of other processes are merged into the queued job instead of adding another one
+            models.UniqueConstraint(fields=['configuration'], condition=models.Q(status='queued'),
+                                    name='unique_queued_generation_job'),
+        ]
+
+    def __str__(self):
+        return f"{self.configuration} ({self.status})"
+
+    def is_pending(self):
+        return self.status in (self.QUEUED, self.RUNNING)
+
+
+class CalendarEvent(models.Model):
+    """
+    Event of a generated calendar, the calendar files are rendered from these rows
+    """
+    ISSUE = 'issue'
+    MILESTONE = 'milestone'
+    TYPE_CHOICES = [
+        (ISSUE, 'Issue'),
+        (MILESTONE, 'Milestone'),
+    ]
+
+    configuration = models.ForeignKey(CalendarConfiguration, on_delete=models.CASCADE, related_name="events")
+    object_type = models.CharField(max_length=10, choices=TYPE_CHOICES)
+    object_id = models.IntegerField()
+    project_id = models.IntegerField(null=True, blank=True)
+    start = models.DateField()
+    end = models.DateField()
+    title = models.TextField()
+    description = models.TextField(default='', blank=True)
+    url = models.URLField(max_length=500, default='', blank=True)
+    updated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['start', 'object_type', 'object_id']
+        constraints = [
+            models.UniqueConstraint(fields=['configuration', 'object_type', 'object_id'], name='unique_calendar_event'),
+        ]
+        indexes = [
+            models.Index(fields=['configuration', 'start']),
+            models.Index(fields=['project_id']),
+        ]
+
+    def __str__(self):
+        return self.title
+
+
+class CompositeCalendar(models.Model):
+    """
+    Subscription that combines the calendars of several configurations under one read token
+    """
+    user = models.ForeignKey(global_settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                             related_name="composite_calendars")
+    name = models.CharField(max_length=100)
+    members = models.ManyToManyField(CalendarConfiguration, related_name="composites")
+    read_token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    content_hash = models.CharField(max_length=64, default='', blank=True, editable=False)
+    # content hashes of the members the file was built from
+    member_hashes = models.JSONField(default=dict, blank=True, editable=False)
+
+    def __str__(self):
+        return self.name
+
+    @staticmethod
+    def get_related():
+        return None
+
+
+class EventFragment(models.Model):
+    """
+    Rendered VEVENT blocks of a project or group, shared by all configurations that show it with the same filters
+    """
+    key = models.CharField(max_length=255, unique=True)
+    # hash of the events the blocks were rendered from
+    marker = models.CharField(max_length=64)
+    blocks = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.key
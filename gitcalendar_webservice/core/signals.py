@@ -0,0 +1,56 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from core.calendar_generator import delete_calendar_file
+from core.composites import build_composite, rebuild_composites
+from core.gitlab_clients import clients
+from core.models import GitLabAPI, CalendarConfiguration, CompositeCalendar
+
+
+@receiver(post_save, sender=GitLabAPI)
+@receiver(post_delete, sender=GitLabAPI)
+def discard_gitlab_client(sender, instance, **kwargs):
+    """
+    Drops the cached client, so that edited urls or tokens are used by the next generation
+    """
+    clients.discard(instance)
+
+
+@receiver(post_save, sender=CalendarConfiguration)
+def update_composites(sender, instance, update_fields=None, **kwargs):
+    """
+    Composite calendars follow the content hashes that the generator stores
+    """
+    if update_fields is not None and 'content_hash' in update_fields:
+        rebuild_composites(instance)
+
+
+@receiver(m2m_changed, sender=CompositeCalendar.members.through)
+def update_changed_composite(sender, instance, action, reverse, **kwargs):
+    if reverse and action == 'pre_clear':
+        # the cleared composites of a configuration are not passed to post_clear
+        instance._cleared_composite_ids = list(instance.composites.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        pk_set = getattr(instance, '_cleared_composite_ids', ()) if action == 'post_clear' else kwargs['pk_set']
+        for composite in CompositeCalendar.objects.filter(pk__in=pk_set or ()):
+            build_composite(composite)
+    else:
+        build_composite(instance)
+
+
+@receiver(pre_delete, sender=CalendarConfiguration)
+def remember_composites(sender, instance, **kwargs):
+    instance._composite_ids = list(instance.composites.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=CompositeCalendar)
+def delete_composite_file(sender, instance, **kwargs):
+    delete_calendar_file(instance.read_token, instance.name + '.ics')
+
+
+@receiver(post_delete, sender=CalendarConfiguration)
+def update_composites_of_deleted(sender, instance, **kwargs):
+    for composite in CompositeCalendar.objects.filter(pk__in=getattr(instance, '_composite_ids', ())):
+        build_composite(composite)
@@ -0,0 +1,96 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, Storage
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import Http404
+from django.utils.functional import LazyObject, empty
+from django.utils.module_loading import import_string
+
+
+def calendar_name(token, filename):
+    """
+    Returns the storage name of a calendar file, names that would leave the directory of the token are rejected
+    """
+    if not filename or filename in ('.', '..') or '/' in filename or '\\' in filename:
+        raise Http404()
+    return f"{token}/{filename}"
+
+
+class LocalCalendarStorage(FileSystemStorage):
+    """
+    Calendars on the local disk, below MEDIA_ROOT by default. Existing files are replaced atomically instead of being
+    saved under another name, readers see either the old or the new calendar.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        file = tempfile.NamedTemporaryFile(dir=os.path.dirname(full_path), prefix='.', suffix='.tmp', delete=False)
+        try:
+            with file:
+                for chunk in content.chunks():
+                    file.write(chunk)
+            # temporary files are only readable by the owner, the front proxy has to read calendars as well
+            os.chmod(file.name, self.file_permissions_mode if self.file_permissions_mode is not None else 0o644)
+            os.replace(file.name, full_path)
+        except BaseException:
+            os.remove(file.name)
+            raise
+        return name
+
+
+class SharedDirectoryStorage(Storage):
+    """
+    Stand-in for an object store, kept in a directory that all nodes mount. Like an object store it offers no local
+    paths, the calendars are only accessed through the storage api.
+    """
+
+    def __init__(self, location=None, base_url=None):
+        self._directory = LocalCalendarStorage(location=location, base_url=base_url)
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _open(self, name, mode='rb'):
+        return self._directory.open(name, mode)
+
+    def _save(self, name, content):
+        return self._directory.save(name, content)
+
+    def delete(self, name):
+        self._directory.delete(name)
+
+    def exists(self, name):
+        return self._directory.exists(name)
+
+    def listdir(self, path):
+        return self._directory.listdir(path)
+
+    def size(self, name):
+        return self._directory.size(name)
+
+    def url(self, name):
+        return self._directory.url(name)
+
+    def get_modified_time(self, name):
+        return self._directory.get_modified_time(name)
+
+
+class CalendarStorage(LazyObject):
+    def _setup(self):
+        self._wrapped = import_string(settings.GITCALENDAR_STORAGE)(**settings.GITCALENDAR_STORAGE_OPTIONS)
+
+
+calendar_storage = CalendarStorage()
+
+
+@receiver(setting_changed)
+def reset_calendar_storage(setting, **kwargs):
+    if setting in ('GITCALENDAR_STORAGE', 'GITCALENDAR_STORAGE_OPTIONS'):
+        calendar_storage._wrapped = empty
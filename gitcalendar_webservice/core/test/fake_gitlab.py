@@ -0,0 +1,228 @@
+"""
+Local stand-in for the GitLab v4 API, which serves synthetic projects, groups, issues and milestones.
+"""
+
+import asyncio
+import json
+import math
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+class FakeGitLab:
+    """
+    Serves `projects` projects with `items` issues and `items // 10` milestones each. With `groups` the projects are
+    distributed over that many groups, every group has its own milestones as well. Every request is delayed by
+    `latency` seconds, lists are paginated like GitLab does.
+    """
+
+    def __init__(self, projects=1, groups=0, items=10, latency=0.0, token='benchmarktoken'):
+        self.latency = latency
+        self.token = token
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self.updated_at = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        self.groups = {gid: {'id': gid, 'name': f'group {gid}', 'full_path': f'group-{gid}'}
+                       for gid in range(1, groups + 1)}
+        self.projects = {}
+        self.issues = {}
+        self.milestones = {}
+        for pid in range(1, projects + 1):
+            gid = (pid - 1) % groups + 1 if groups else None
+            namespace = f'group {gid}' if gid else 'user'
+            self.projects[pid] = {'id': pid, 'name': f'project {pid}', 'namespace_id': gid,
+                                  'name_with_namespace': f'{namespace} / project {pid}',
+                                  'path_with_namespace': f'{namespace}/project-{pid}'}
+            for iid in range(1, items + 1):
+                self.add_issue(pid, f'issue {iid} of project {pid}')
+            for iid in range(1, items // 10 + 1):
+                self.add_milestone(f'milestone {iid} of project {pid}', project_id=pid)
+        for gid in self.groups:
+            for iid in range(1, items // 10 + 1):
+                self.add_milestone(f'milestone {iid} of group {gid}', group_id=gid)
+
+    def _due_date(self, number):
+        return (date(2021, 1, 1) + timedelta(days=number % 365)).isoformat()
+
+    def add_issue(self, project_id, title, state='opened'):
+        issue_id = len(self.issues) + 1
+        self.issues[issue_id] = {
+            'id': issue_id, 'iid': issue_id, 'project_id': project_id, 'title': title, 'description': title,
+            'state': state, 'due_date': self._due_date(issue_id), 'milestone': None,
+            'web_url': f'https://gitlab.example.org/project-{project_id}/-/issues/{issue_id}',
+            'updated_at': self.updated_at.isoformat(),
+        }
+        return self.issues[issue_id]
+
+    def add_milestone(self, title, project_id=None, group_id=None, state='active'):
+        milestone_id = len(self.milestones) + 1
+        owner = f'project-{project_id}' if project_id else f'groups/group-{group_id}'
+        self.milestones[milestone_id] = {
+            'id': milestone_id, 'iid': milestone_id, 'project_id': project_id, 'group_id': group_id, 'title': title,
+            'description': title, 'state': state, 'due_date': self._due_date(milestone_id),
+            'web_url': f'https://gitlab.example.org/{owner}/-/milestones/{milestone_id}',
+            'updated_at': self.updated_at.isoformat(),
+        }
+        return self.milestones[milestone_id]
+
+    def touch(self, item, **changes):
+        """
+        Changes an issue or milestone, its update time is moved to now like GitLab does
+        """
+        item.update(changes, updated_at=datetime.now(timezone.utc).isoformat())
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _handler(self))
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+    def _count(self, size):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += size
+
+    def route(self, path, query):
+        """
+        Returns the status code and the result of a request, lists are returned unpaginated
+        """
+        parts = path.strip('/').split('/')[2:]
+        if parts == ['user']:
+            return 200, {'id': 1, 'username': 'benchmark'}
+        if len(parts) < 2 or parts[0] not in ('projects', 'groups') or not parts[1].isdigit():
+            return 404, {'message': '404 Not Found'}
+        kind, instance_id = parts[0], int(parts[1])
+        instances = self.projects if kind == 'projects' else self.groups
+        if instance_id not in instances:
+            return 404, {'message': f'404 {kind[:-1].capitalize()} Not Found'}
+        if len(parts) == 2:
+            return 200, instances[instance_id]
+        if len(parts) != 3 or parts[2] not in ('issues', 'milestones'):
+            return 404, {'message': '404 Not Found'}
+
+        if kind == 'projects':
+            owned = lambda item: item['project_id'] == instance_id  # noqa: E731
+        elif parts[2] == 'issues':
+            owned = lambda item: self.projects[item['project_id']]['namespace_id'] == instance_id  # noqa: E731
+        else:
+            owned = lambda item: item['group_id'] == instance_id  # noqa: E731
+        state = query.get('state', 'all')
+        updated_after = _parse_time(query['updated_after']) if 'updated_after' in query else None
+        items = self.issues if parts[2] == 'issues' else self.milestones
+        return 200, [item for item in items.values() if owned(item)
+                     and state in ('all', item['state'])
+                     and (updated_after is None or _parse_time(item['updated_at']) > updated_after)]
+
+
+    def respond(self, path, token, host):
+        """
+        Returns the status code, headers and body of a request, lists are paginated like GitLab does
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        headers = {}
+        if token != self.token:
+            status, result = 401, {'message': '401 Unauthorized'}
+        else:
+            status, result = self.route(url.path, query)
+        if isinstance(result, list):
+            page = int(query.get('page', 1))
+            per_page = min(int(query.get('per_page', 20)), 100)
+            pages = max(math.ceil(len(result) / per_page), 1)
+            headers.update({'X-Page': page, 'X-Per-Page': per_page, 'X-Total': len(result),
+                            'X-Total-Pages': pages})
+            if page < pages:
+                next_query = urlencode(dict(query, page=page + 1, per_page=per_page))
+                headers['X-Next-Page'] = page + 1
+                headers['Link'] = f'<http://{host}{url.path}?{next_query}>; rel="next"'
+            result = result[(page - 1) * per_page:page * per_page]
+        body = json.dumps(result).encode()
+        self._count(len(body))
+        return status, headers, body
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers, body):
+        self.status_code = status_code
+        self.headers = {name: str(value) for name, value in headers.items()}
+        self.content = body
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeAsyncClient:
+    """
+    Stand-in for httpx.AsyncClient that answers from a FakeGitLab without a server. Every request takes `delay`
+    seconds, the highest number of concurrent requests is recorded.
+    """
+
+    def __init__(self, gitlab, delay=0.0):
+        self.gitlab = gitlab
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def get(self, url, params=None, headers=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        url = urlparse(url)
+        path = url.path + ('?' + urlencode(params) if params else '')
+        return FakeResponse(*self.gitlab.respond(path, (headers or {}).get('PRIVATE-TOKEN'), url.netloc))
+
+    async def aclose(self):
+        pass
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _handler(gitlab):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            status, headers, body = gitlab.respond(self.path, self.headers.get('PRIVATE-TOKEN'), self.headers['Host'])
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, str(value))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
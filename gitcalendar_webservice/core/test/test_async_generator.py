@@ -0,0 +1,130 @@
+import asyncio
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from gitlab import GitlabAuthenticationError, GitlabParsingError
+
+from core.async_generator import agenerate, prefetch
+from core.calendar_generator import generator
+from core.gitlab_clients import clients
+from core.models import GitLabAPI, CalendarConfiguration
+from core.test.fake_gitlab import FakeAsyncClient, FakeGitLab
+
+MEDIA_ROOT = tempfile.mkdtemp()
+THROTTLE_DIR = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, GITCALENDAR_THROTTLE_DIR=THROTTLE_DIR, GITCALENDAR_THROTTLE_RATE=10000)
+class AsyncGeneratorTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        shutil.rmtree(THROTTLE_DIR, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self) -> None:
+        self.gitlab = FakeGitLab(projects=3, groups=1, items=150).start()
+        self.addCleanup(self.gitlab.stop)
+        User.objects.create_user('tester', password='test')
+        self.api = GitLabAPI.objects.create(
+            user=User.objects.get(username='tester'),
+            api_name='fake gitlab',
+            url=self.gitlab.url,
+            gitlab_api_token=self.gitlab.token
+        )
+        self.config = CalendarConfiguration.objects.create(
+            user=User.objects.get(username='tester'),
+            api=self.api,
+            config_name='fake'
+        )
+        self.config.set_project_ids('1,2,3')
+        self.config.set_group_ids('1')
+        self.http = FakeAsyncClient(self.gitlab, delay=0.001)
+        patcher = mock.patch('core.async_generator.create_client', return_value=self.http)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        clients.clear()
+
+    def read_calendar(self, config):
+        with open(f'{MEDIA_ROOT}/{config.read_token}/{config.config_name}.ics', encoding='utf-8') as file:
+            return file.read()
+
+    def test_same_calendar_as_synchronous_generation(self):
+        generator(self.config)
+        expected = self.read_calendar(self.config)
+
+        copy = CalendarConfiguration.objects.create(user=self.config.user, api=self.api, config_name='copy')
+        copy.set_project_ids('1,2,3')
+        copy.set_group_ids('1')
+        self.gitlab.reset_counters()
+        fetcher = prefetch([copy])[copy.pk]
+        with mock.patch.object(clients, 'get') as get_client:
+            generator(copy, fetcher)
+            get_client.assert_not_called()
+        # the lists are dropped once the configuration is generated
+        self.assertEqual(fetcher._results, {})
+        self.assertEqual(self.read_calendar(copy), expected)
+        # pages of 100 items: 2 issue pages and 1 milestone page per project, 5 + 1 for the group, then the names
+        self.assertEqual(self.gitlab.requests, 3 * 3 + 6 + 4)
+
+    @override_settings(GITCALENDAR_ASYNC_PER_HOST=3)
+    def test_concurrency_per_host(self):
+        prefetch([self.config])
+        self.assertEqual(self.http.max_in_flight, 3)
+
+    def test_missing_project(self):
+        self.config.set_project_ids('1,99')
+        with mock.patch('sys.stderr', new_callable=StringIO) as stderr:
+            generator(self.config, prefetch([self.config])[self.config.pk])
+        self.assertIn('99 is not existing', stderr.getvalue())
+        self.assertIn('issue 1 of project 1 ', self.read_calendar(self.config))
+
+    def test_invalid_json(self):
+        respond = self.gitlab.respond
+        with mock.patch.object(self.gitlab, 'respond', lambda path, token, host: (200, {}, b'<html></html>')
+                               if path.startswith('/api/v4/projects/2/issues') else respond(path, token, host)):
+            fetcher = prefetch([self.config])[self.config.pk]
+        with self.assertRaises(GitlabParsingError):
+            generator(self.config, fetcher)
+
+    def test_throttle_outside_event_loop(self):
+        def reserve(host):
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return 0.0
+            raise AssertionError('the throttle is waited for in the event loop')
+
+        with mock.patch('core.async_generator.throttle.reserve', side_effect=reserve) as reserved:
+            prefetch([self.config])
+        self.assertTrue(reserved.called)
+
+    def test_wrong_token(self):
+        self.api.gitlab_api_token = 'wrong'
+        self.api.save()
+        config = CalendarConfiguration.objects.select_related('api').get(pk=self.config.pk)
+        with self.assertRaises(GitlabAuthenticationError):
+            generator(config, prefetch([config])[config.pk])
+
+    def test_agenerate(self):
+        async_to_sync(agenerate)(self.config)
+        self.assertEqual(self.read_calendar(self.config).count('BEGIN:VEVENT'), 3 * 150 + 3 * 15 + 15)
+
+    def test_update_calendar(self):
+        out = StringIO()
+        call_command('update_calendar', '--asyncio', stdout=out)
+        self.assertIn('Successfully updated 1 calendar configurations', out.getvalue())
+        self.assertGreater(self.http.max_in_flight, 1)
+
+    def test_update_calendar_without_httpx(self):
+        with mock.patch('core.async_generator.create_client', side_effect=ImproperlyConfigured('httpx is missing')):
+            with self.assertRaises(CommandError):
+                call_command('update_calendar', '--asyncio', stdout=StringIO())
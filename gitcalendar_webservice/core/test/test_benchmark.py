@@ -0,0 +1,117 @@
+"""
+Generation benchmark against the local GitLab stand-in, it only runs with GITCALENDAR_BENCHMARK set:
+
+    GITCALENDAR_BENCHMARK=1 python manage.py test core.test.test_benchmark
+
+The size is set with GITCALENDAR_BENCHMARK_CONFIGS, GITCALENDAR_BENCHMARK_PROJECTS, GITCALENDAR_BENCHMARK_ITEMS
+and GITCALENDAR_BENCHMARK_LATENCY (seconds per request). With GITCALENDAR_BENCHMARK_REPORT the results are
+written as json to that file.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import unittest
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core.gitlab_clients import clients
+from core.models import GitLabAPI, CalendarConfiguration
+from core.test.fake_gitlab import FakeGitLab
+
+CONFIGS = int(os.environ.get('GITCALENDAR_BENCHMARK_CONFIGS', 20))
+PROJECTS = int(os.environ.get('GITCALENDAR_BENCHMARK_PROJECTS', 5))
+ITEMS = int(os.environ.get('GITCALENDAR_BENCHMARK_ITEMS', 200))
+LATENCY = float(os.environ.get('GITCALENDAR_BENCHMARK_LATENCY', 0.01))
+REPORT = os.environ.get('GITCALENDAR_BENCHMARK_REPORT')
+
+MEDIA_ROOT = tempfile.mkdtemp()
+THROTTLE_DIR = tempfile.mkdtemp()
+
+
+def pages(items, per_page=20):
+    """
+    Number of requests python-gitlab needs to list the items with its default page size
+    """
+    return max(-(-items // per_page), 1)
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+@unittest.skipUnless(os.environ.get('GITCALENDAR_BENCHMARK'), 'set GITCALENDAR_BENCHMARK to run the benchmark')
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, GITCALENDAR_THROTTLE_DIR=THROTTLE_DIR, GITCALENDAR_THROTTLE_RATE=10000)
+class GenerationBenchmark(TestCase):
+    results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        shutil.rmtree(THROTTLE_DIR, ignore_errors=True)
+        report = {'configs': CONFIGS, 'projects': PROJECTS, 'items': ITEMS, 'latency': LATENCY,
+                  'scenarios': cls.results}
+        sys.stderr.write('\n' + json.dumps(report, indent=2) + '\n')
+        if REPORT:
+            with open(REPORT, 'w') as file:
+                json.dump(report, file, indent=2)
+        super().tearDownClass()
+
+    def setUp(self) -> None:
+        self.gitlab = FakeGitLab(projects=PROJECTS, groups=1, items=ITEMS, latency=LATENCY).start()
+        self.addCleanup(self.gitlab.stop)
+        user = User.objects.create_user('benchmark', password='benchmark')
+        GitLabAPI.objects.create(user=user, api_name='fake gitlab', url=self.gitlab.url,
+                                 gitlab_api_token=self.gitlab.token)
+        projects = ','.join(str(pid) for pid in self.gitlab.projects)
+        for number in range(CONFIGS):
+            # every configuration shows all projects, every second one also their group
+            config = CalendarConfiguration.objects.create(user=user, api_id=1, config_name=f'config{number}')
+            config.set_project_ids(projects)
+            config.set_group_ids('1' if number % 2 else '')
+        clients.clear()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def measure(self, scenario):
+        """
+        Runs update_calendar for all configurations and records the numbers of the scenario
+        """
+        self.gitlab.reset_counters()
+        written = directory_size(MEDIA_ROOT)
+        tracemalloc.start()
+        started = time.perf_counter()
+        call_command('update_calendar', stdout=StringIO())
+        wall_time = time.perf_counter() - started
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.results[scenario] = {
+            'wall_time': round(wall_time, 3),
+            'requests': self.gitlab.requests,
+            'bytes_received': self.gitlab.bytes_sent,
+            'peak_memory': peak_memory,
+            'bytes_written': directory_size(MEDIA_ROOT) - written,
+        }
+        return self.results[scenario]
+
+    def test_full_sync(self):
+        result = self.measure('full_sync')
+        # authentication, then every instance and its lists are fetched once for all configurations
+        project_requests = PROJECTS * (1 + pages(ITEMS) + pages(ITEMS // 10))
+        group_requests = 1 + pages(PROJECTS * ITEMS) + pages(ITEMS // 10)
+        self.assertEqual(result['requests'], 1 + project_requests + group_requests)
+        self.assertEqual(CalendarConfiguration.objects.filter(file_exists=True).count(), CONFIGS)
+
+    def test_incremental_sync(self):
+        self.measure('initial_sync')
+        for project_id in self.gitlab.projects:
+            self.gitlab.touch(self.gitlab.add_issue(project_id, 'new issue'))
+        result = self.measure('incremental_sync')
+        # only the changed items are listed, the new group issues need the names of their projects
+        self.assertEqual(result['requests'], PROJECTS * 2 + 2 + PROJECTS)
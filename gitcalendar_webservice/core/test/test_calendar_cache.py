@@ -0,0 +1,42 @@
+from django.test import SimpleTestCase, override_settings
+
+from core.calendar_cache import CalendarCache
+
+
+@override_settings(GITCALENDAR_CACHE_MAX_BYTES=100, GITCALENDAR_CACHE_MAX_ENTRIES=3)
+class CalendarCacheTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.cache = CalendarCache()
+
+    def test_hit_and_stale_stamp(self):
+        self.assertIsNone(self.cache.get(('token', 'a.ics', None), (1, 5)))
+        self.cache.put(('token', 'a.ics', None), (1, 5), b'12345')
+        self.assertEqual(self.cache.get(('token', 'a.ics', None), (1, 5)), b'12345')
+        self.assertIsNone(self.cache.get(('token', 'a.ics', None), (2, 5)))
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 2, 'evictions': 0, 'entries': 0, 'bytes': 0})
+
+    def test_entry_limit(self):
+        for name in ('a', 'b', 'c'):
+            self.cache.put(('token', name, None), 1, b'1')
+        self.cache.get(('token', 'a', None), 1)
+        self.cache.put(('token', 'd', None), 1, b'1')
+        self.assertIsNone(self.cache.get(('token', 'b', None), 1))
+        self.assertIsNotNone(self.cache.get(('token', 'a', None), 1))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    @override_settings(GITCALENDAR_CACHE_MAX_ENTRIES=20)
+    def test_byte_limit(self):
+        self.cache.put(('token', 'big', None), 1, b'1' * 11)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        for number in range(11):
+            self.cache.put(('token', number, None), 1, b'1' * 10)
+        self.assertIsNone(self.cache.get(('token', 0, None), 1))
+        self.assertEqual(self.cache.stats()['bytes'], 100)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_invalidate(self):
+        self.cache.put(('token1', 'a', None), 1, b'1')
+        self.cache.put(('token1', 'a', 'gzip'), 1, b'1')
+        self.cache.put(('token2', 'a', None), 1, b'1')
+        self.cache.invalidate('token1')
+        self.assertEqual(self.cache.stats()['entries'], 1)
@@ -0,0 +1,271 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.calendar_generator import generator, prune_fragments, render_calendar, render_event, share_fetches
+from core.gitlab_clients import clients
+from core.metrics import metrics
+from core.models import GitLabAPI, CalendarConfiguration, EventFragment
+from core.test.fake_gitlab import FakeGitLab
+
+MEDIA_ROOT = tempfile.mkdtemp()
+THROTTLE_DIR = tempfile.mkdtemp()
+
+
+def make_issue(issue_id, due_date='2021-10-01', state='opened', title='issue'):
+    return SimpleNamespace(id=issue_id, project_id=1, title=f'{title} {issue_id}', description='', milestone=None,
+                           due_date=due_date, state=state, web_url=f'https://example.org/issues/{issue_id}',
+                           updated_at='2021-09-01T00:00:00Z')
+
+
+class StubManager:
+    def __init__(self, items):
+        self.items = items
+        self.calls = []
+
+    def list(self, **filters):
+        self.calls.append(filters)
+        return self.items
+
+
+class StubProjects:
+    def __init__(self, issues, milestones):
+        self.project = SimpleNamespace(name='project', name_with_namespace='group / project',
+                                       issues=StubManager(issues), milestones=StubManager(milestones))
+
+    def get(self, pid, lazy=False):
+        return self.project
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class IncrementalGeneratorTests(TestCase):
+    def setUp(self) -> None:
+        User.objects.create_user('tester', password='test')
+        GitLabAPI.objects.create(
+            user=User.objects.get(username='tester'),
+            api_name='api from tester',
+            url='https://example.org/',
+            gitlab_api_token='mytesttoken'
+        )
+        self.config = CalendarConfiguration.objects.create(
+            user=User.objects.get(username='tester'),
+            api_id=1,
+            config_name='test1'
+        )
+        self.config.set_project_ids('1')
+        self.projects = StubProjects([make_issue(1), make_issue(2)], [])
+        patcher = mock.patch('core.calendar_generator.clients')
+        patcher.start().get.return_value = SimpleNamespace(projects=self.projects)
+        self.addCleanup(patcher.stop)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def read_calendar(self):
+        with open(f'{MEDIA_ROOT}/{self.config.read_token}/test1.ics', encoding='utf-8') as file:
+            return file.read()
+
+    def test_full_then_incremental_sync(self):
+        generator(self.config)
+        issues = self.projects.project.issues
+        self.assertEqual(issues.calls[-1], {'all': True, 'state': 'opened'})
+        self.assertIsNotNone(self.config.sync_cursor)
+        self.assertIn('issue 2', self.read_calendar())
+
+        issues.items = [make_issue(2, state='closed'), make_issue(3, title='new')]
+        generator(CalendarConfiguration.objects.get(pk=self.config.pk))
+        self.assertEqual(issues.calls[-1]['state'], 'all')
+        self.assertIn('updated_after', issues.calls[-1])
+        content = self.read_calendar()
+        self.assertIn('issue 1', content)
+        self.assertNotIn('issue 2', content)
+        self.assertIn('new 3', content)
+
+    def test_changed_configuration_resyncs(self):
+        generator(self.config)
+        self.config.only_issues = True
+        generator(self.config)
+        self.assertEqual(self.projects.project.issues.calls[-1], {'all': True, 'state': 'opened'})
+
+    @override_settings(GITCALENDAR_FULL_SYNC_INTERVAL=-1)
+    def test_expired_full_sync(self):
+        generator(self.config)
+        generator(self.config)
+        self.assertEqual(self.projects.project.issues.calls[-1], {'all': True, 'state': 'opened'})
+
+    def test_event_table(self):
+        generator(self.config)
+        rows = list(self.config.events.values_list('object_type', 'object_id', 'title'))
+        self.assertEqual(rows, [('issue', 1, 'issue 1 (ISSUE) [project]'), ('issue', 2, 'issue 2 (ISSUE) [project]')])
+        first_row = self.config.events.get(object_id=1)
+
+        self.projects.project.issues.items = [make_issue(2, due_date='2021-09-01', title='moved'),
+                                              make_issue(1, state='closed')]
+        generator(CalendarConfiguration.objects.get(pk=self.config.pk))
+        event = self.config.events.get()
+        self.assertEqual((event.object_id, event.title, str(event.start), str(event.end)),
+                         (2, 'moved 2 (ISSUE) [project]', '2021-09-01', '2021-09-02'))
+        self.assertFalse(self.config.events.filter(pk=first_row.pk).exists())
+        self.assertIn('SUMMARY:moved 2', self.read_calendar())
+
+    def test_fragments_reused(self):
+        self.config.set_project_ids('1,2')
+        generator(self.config)
+        self.assertEqual(EventFragment.objects.count(), 2)
+        with mock.patch('core.calendar_generator.render_event', wraps=render_event) as rendering:
+            generator(CalendarConfiguration.objects.get(pk=self.config.pk))
+            rendering.assert_not_called()
+        first = self.read_calendar()
+        rendered = render_calendar(self.config.events.all(), 0.0, 'example.org')
+        self.assertEqual(first, rendered.replace('\r\n', '\n'))
+
+        # both projects share the stub, only changes of a project are rendered again
+        self.projects.project.issues.items = [make_issue(2, title='changed')]
+        with mock.patch('core.calendar_generator.render_event', wraps=render_event) as rendering:
+            generator(CalendarConfiguration.objects.get(pk=self.config.pk))
+            self.assertEqual(rendering.call_count, 2 * 2)
+        self.assertIn('changed 2', self.read_calendar())
+
+    def test_unused_fragments_pruned(self):
+        generator(self.config)
+        self.assertTrue(EventFragment.objects.get().key.startswith(f'example.org/{self.config.api_id}/project:1/'))
+        unused_since = timezone.now() - timedelta(days=30)
+        EventFragment.objects.update(updated_at=unused_since)
+        generator(CalendarConfiguration.objects.get(pk=self.config.pk))
+        self.assertGreater(EventFragment.objects.get().updated_at, unused_since)
+        self.assertEqual(prune_fragments(), 0)
+
+        EventFragment.objects.update(updated_at=unused_since)
+        self.assertEqual(prune_fragments(), 1)
+        self.assertFalse(EventFragment.objects.exists())
+
+    def test_stable_output(self):
+        generator(self.config)
+        first = self.read_calendar()
+        self.projects.project.issues.items = []
+        generator(self.config)
+        self.assertEqual(self.read_calendar(), first)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class SharedFetchTests(TestCase):
+    def setUp(self) -> None:
+        User.objects.create_user('tester', password='test')
+        for token in ('mytesttoken', 'mytesttoken', 'othertoken'):
+            GitLabAPI.objects.create(
+                user=User.objects.get(username='tester'),
+                api_name='api from tester',
+                url='https://example.org/',
+                gitlab_api_token=token
+            )
+        for api_id in (1, 2, 3):
+            config = CalendarConfiguration.objects.create(
+                user=User.objects.get(username='tester'),
+                api_id=api_id,
+                config_name=f'config{api_id}'
+            )
+            config.set_project_ids('1')
+        self.projects = StubProjects([make_issue(1)], [make_issue(2)])
+        patcher = mock.patch('core.calendar_generator.clients')
+        patcher.start().get.return_value = SimpleNamespace(projects=self.projects)
+        self.addCleanup(patcher.stop)
+
+    def test_projects_fetched_once_per_token(self):
+        configs = list(CalendarConfiguration.objects.select_related('api'))
+        fetchers = share_fetches(configs)
+        self.assertIs(fetchers[configs[0].pk], fetchers[configs[1].pk])
+        self.assertIsNot(fetchers[configs[0].pk], fetchers[configs[2].pk])
+        for config in configs:
+            generator(config, fetchers[config.pk])
+        self.assertEqual(len(self.projects.project.issues.calls), 2)
+        self.assertEqual(len(self.projects.project.milestones.calls), 2)
+        self.assertIn('issue 1', configs[1].sync_state['instances']['project:1']['events']['issue:1']['title'])
+        # nothing is kept once every configuration is generated
+        for fetcher in fetchers.values():
+            self.assertEqual(fetcher._results, {})
+            self.assertEqual(fetcher._locks, {})
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, GITCALENDAR_THROTTLE_DIR=THROTTLE_DIR, GITCALENDAR_THROTTLE_RATE=1000)
+class FakeGitLabGeneratorTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(THROTTLE_DIR, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self) -> None:
+        self.gitlab = FakeGitLab(projects=2, groups=1, items=30).start()
+        self.addCleanup(self.gitlab.stop)
+        User.objects.create_user('tester', password='test')
+        GitLabAPI.objects.create(
+            user=User.objects.get(username='tester'),
+            api_name='fake gitlab',
+            url=self.gitlab.url,
+            gitlab_api_token=self.gitlab.token
+        )
+        self.config = CalendarConfiguration.objects.create(
+            user=User.objects.get(username='tester'),
+            api_id=1,
+            config_name='fake'
+        )
+        self.config.set_project_ids('2')
+        self.config.set_group_ids('1')
+        clients.clear()
+
+    def read_calendar(self):
+        with open(f'{MEDIA_ROOT}/{self.config.read_token}/fake.ics', encoding='utf-8') as file:
+            return file.read()
+
+    def test_generation(self):
+        metrics.clear()
+        generator(self.config)
+        content = self.read_calendar()
+        self.assertEqual(content.count('BEGIN:VEVENT'), 60 + 3 + 3)
+        self.assertIn('SUMMARY:issue 1 of project 1 (ISSUE) [group 1 / project 1]', content)
+        self.assertIn('SUMMARY:milestone 1 of group 1 (MILESTONE) [group 1]', content)
+        self.assertIn('SUMMARY:milestone 1 of project 2 (MILESTONE) [project 2]', content)
+        self.assertEqual(self.config.memberships.get(kind='group').path, 'group-1')
+
+        self.gitlab.touch(self.gitlab.issues[1], state='closed')
+        self.gitlab.touch(self.gitlab.add_issue(2, 'new issue'))
+        self.gitlab.reset_counters()
+        generator(CalendarConfiguration.objects.get(pk=self.config.pk))
+        # the client is reused and only the changed items are listed, the group issue needs the name of its project
+        self.assertEqual(self.gitlab.requests, 4 + 1)
+        content = self.read_calendar()
+        self.assertNotIn('issue 1 of project 1 ', content)
+        self.assertIn('SUMMARY:new issue (ISSUE) [group 1 / project 2]', content)
+
+        host = self.gitlab.url.split('//')[1]
+        output = metrics.render()
+        for phase in ('auth', 'fetch', 'render', 'write'):
+            self.assertIn(f'gitcalendar_generation_phase_seconds_count{{host="{host}",phase="{phase}"}}', output)
+        self.assertIn(f'gitcalendar_generations_total{{host="{host}"}} 2\n', output)
+        self.assertIn(f'gitcalendar_events_total{{host="{host}"}} {66 + 66}\n', output)
+
+    def test_failed_instance_fetched_fully(self):
+        route = self.gitlab.route
+        denied = lambda path, query: (404, {'message': '404 Project Not Found'}) \
+            if path.startswith('/api/v4/projects/2') else route(path, query)  # noqa: E731
+        with mock.patch.object(self.gitlab, 'route', denied), \
+                mock.patch('sys.stderr', new_callable=StringIO) as stderr:
+            generator(self.config)
+        self.assertIn('2 is not existing', stderr.getvalue())
+        self.assertNotIn('milestone 1 of project 2', self.read_calendar())
+
+        # the project has no stored events, the next incremental sync fetches all of its items
+        config = CalendarConfiguration.objects.get(pk=self.config.pk)
+        generator(config)
+        content = self.read_calendar()
+        self.assertEqual(content.count('BEGIN:VEVENT'), 60 + 3 + 3)
+        self.assertIn('SUMMARY:milestone 1 of project 2 (MILESTONE) [project 2]', content)
+        self.assertEqual(len(config.sync_state['instances']['project:2']['events']), 30 + 3)
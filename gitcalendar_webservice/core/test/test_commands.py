@@ -0,0 +1,134 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+
+from core.jobs import enqueue_generation
+from core.models import GitLabAPI, CalendarConfiguration, EventFragment, GenerationJob
+
+
+class UpdateCalendarCommandTests(TestCase):
+    def setUp(self) -> None:
+        User.objects.create_user('tester', password='test')
+        GitLabAPI.objects.create(
+            user=User.objects.get(username='tester'),
+            api_name='api from tester',
+            url='https://example.org/',
+            gitlab_api_token='mytesttoken'
+        )
+        for name in ('config1', 'config2', 'config3'):
+            config = CalendarConfiguration.objects.create(
+                user=User.objects.get(username='tester'),
+                api_id=1,
+                config_name=name
+            )
+            config.set_project_ids('28236929')
+
+    @mock.patch('core.management.commands.update_calendar.generator')
+    def test_update_all(self, generator):
+        fragment = EventFragment.objects.create(key='example.org/1/project:1/issues/0.0', marker='')
+        EventFragment.objects.filter(pk=fragment.pk).update(updated_at=timezone.now() - timedelta(days=30))
+        out = StringIO()
+        call_command('update_calendar', workers=2, stdout=out)
+        self.assertEqual(generator.call_count, 3)
+        self.assertIn('Successfully updated 3 calendar configurations', out.getvalue())
+        self.assertIn('Removed 1 unused event fragments', out.getvalue())
+        self.assertEqual(CalendarConfiguration.objects.filter(file_exists=True).count(), 3)
+
+    @mock.patch('core.management.commands.update_calendar.generator')
+    def test_update_with_failures(self, generator):
+        generator.side_effect = lambda config, fetcher: 1 / (config.config_name != 'config2')
+        err = StringIO()
+        with self.assertRaises(CommandError) as ce:
+            call_command('update_calendar', workers=3, stdout=StringIO(), stderr=err)
+        self.assertIn('1 of 3 calendar configurations failed: "config2"', str(ce.exception))
+        self.assertIn('Calendar Configuration "config2" failed', err.getvalue())
+        self.assertFalse(CalendarConfiguration.objects.get(config_name='config2').file_exists)
+        self.assertTrue(CalendarConfiguration.objects.get(config_name='config1').file_exists)
+
+    def test_invalid_workers(self):
+        with self.assertRaises(CommandError):
+            call_command('update_calendar', workers=0)
+
+
+class RunGenerationJobsCommandTests(TestCase):
+    def setUp(self) -> None:
+        User.objects.create_user('tester', password='test')
+        GitLabAPI.objects.create(
+            user=User.objects.get(username='tester'),
+            api_name='api from tester',
+            url='https://example.org/',
+            gitlab_api_token='mytesttoken'
+        )
+        for name in ('config1', 'config2'):
+            config = CalendarConfiguration.objects.create(
+                user=User.objects.get(username='tester'),
+                api_id=1,
+                config_name=name
+            )
+            config.set_project_ids('28236929')
+            enqueue_generation(config)
+
+    @mock.patch('core.management.commands.run_generation_jobs.close_old_connections')
+    @mock.patch('core.jobs.generator')
+    def test_drain_queue_once(self, generator, close_old_connections):
+        out = StringIO()
+        call_command('run_generation_jobs', once=True, stdout=out)
+        self.assertEqual(generator.call_count, 2)
+        close_old_connections.assert_called_once()
+        self.assertIn('Processed 2 generation jobs', out.getvalue())
+        self.assertEqual(GenerationJob.objects.filter(status=GenerationJob.DONE).count(), 2)
+
+
+class RunSchedulerCommandTests(TestCase):
+    def setUp(self) -> None:
+        User.objects.create_user('tester', password='test')
+        GitLabAPI.objects.create(
+            user=User.objects.get(username='tester'),
+            api_name='api from tester',
+            url='https://example.org/',
+            gitlab_api_token='mytesttoken'
+        )
+        for name, interval in (('due', 60), ('new', 60), ('unscheduled', None)):
+            config = CalendarConfiguration.objects.create(
+                user=User.objects.get(username='tester'),
+                api_id=1,
+                config_name=name,
+                refresh_interval=interval
+            )
+            config.set_project_ids('28236929')
+        CalendarConfiguration.objects.filter(config_name='due').update(
+            next_refresh_at=timezone.now() - timedelta(minutes=1))
+
+    def test_queue_due_configurations(self):
+        before = timezone.now()
+        out = StringIO()
+        call_command('run_scheduler', once=True, jitter=0.1, stdout=out)
+        self.assertIn('Queued "due"', out.getvalue())
+        self.assertEqual(list(GenerationJob.objects.values_list('configuration__config_name', flat=True)), ['due'])
+
+        due = CalendarConfiguration.objects.get(config_name='due')
+        self.assertGreaterEqual(due.next_refresh_at, before + timedelta(minutes=54))
+        self.assertLessEqual(due.next_refresh_at, timezone.now() + timedelta(minutes=66))
+        new = CalendarConfiguration.objects.get(config_name='new')
+        self.assertGreaterEqual(new.next_refresh_at, before)
+        self.assertLessEqual(new.next_refresh_at, timezone.now() + timedelta(minutes=60))
+        self.assertIsNone(CalendarConfiguration.objects.get(config_name='unscheduled').next_refresh_at)
+
+        call_command('run_scheduler', once=True, stdout=StringIO())
+        self.assertEqual(GenerationJob.objects.count(), 1)
+
+    def test_zero_interval(self):
+        CalendarConfiguration.objects.filter(config_name='due').update(refresh_interval=0)
+        out = StringIO()
+        call_command('run_scheduler', once=True, jitter=0, stdout=out)
+        self.assertEqual(out.getvalue().count('Queued "due"'), 1)
+        self.assertGreater(CalendarConfiguration.objects.get(config_name='due').next_refresh_at, timezone.now())
+        with self.assertRaises(ValidationError):
+            CalendarConfiguration.objects.get(config_name='due').full_clean()
@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core.calendar_generator import CALENDAR_FOOTER, CALENDAR_HEADER, render_calendar, write_calendar
+from core.composites import build_composite
+from core.models import GitLabAPI, CalendarConfiguration, CalendarEvent, CompositeCalendar
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class CompositeCalendarTests(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user('tester', password='test')
+        GitLabAPI.objects.create(
+            user=self.user,
+            api_name='api from tester',
+            url='https://example.org/',
+            gitlab_api_token='mytesttoken'
+        )
+        self.configs = [CalendarConfiguration.objects.create(user=self.user, api_id=1, config_name=name)
+                        for name in ('team1', 'team2')]
+        for config in self.configs:
+            config.set_project_ids('1')
+        self.generate(self.configs[0], [1, 2])
+        self.generate(self.configs[1], [2, 3])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def generate(self, config, issue_ids):
+        config.events.all().delete()
+        for issue_id in issue_ids:
+            CalendarEvent.objects.create(configuration=config, object_type=CalendarEvent.ISSUE, object_id=issue_id,
+                                         start='2021-10-01', end='2021-10-02', title=f'{config} issue {issue_id}')
+        config.content_hash = write_calendar(config, render_calendar(config.events.all(), 0.0, 'example.org'))
+        config.save(update_fields=['content_hash'])
+
+    def read_composite(self, composite):
+        with open(f'{MEDIA_ROOT}/{composite.read_token}/{composite.name}.ics', encoding='utf-8', newline='') as file:
+            return file.read()
+
+    def test_build(self):
+        composite = CompositeCalendar.objects.create(user=self.user, name='managers')
+        composite.members.set(self.configs)
+        composite.refresh_from_db()
+        content = self.read_composite(composite)
+        self.assertTrue(content.startswith(CALENDAR_HEADER))
+        self.assertTrue(content.endswith(CALENDAR_FOOTER))
+        self.assertEqual(content.count('BEGIN:VEVENT'), 3)
+        self.assertIn('SUMMARY:team1 issue 2', content)
+        self.assertNotIn('team2 issue 2', content)
+        self.assertIn('SUMMARY:team2 issue 3', content)
+        self.assertEqual(composite.member_hashes, {str(config.pk): config.content_hash for config in self.configs})
+
+    def test_foreign_member_file(self):
+        # files of the previous converter have another header and may use LF line breaks
+        with open(f'{MEDIA_ROOT}/{self.configs[0].read_token}/team1.ics', 'w', encoding='utf-8', newline='') as file:
+            file.write('BEGIN:VCALENDAR\nVERSION:2.0\nPRODID:-//gitcalendar//EN\nX-WR-CALNAME:team1\n'
+                       'BEGIN:VEVENT\nUID:old@example.org\nSUMMARY:old issue\nEND:VEVENT\nEND:VCALENDAR\n')
+        composite = CompositeCalendar.objects.create(user=self.user, name='managers')
+        composite.members.set(self.configs)
+        content = self.read_composite(composite)
+        self.assertIn('BEGIN:VEVENT\r\nUID:old@example.org\r\nSUMMARY:old issue\r\nEND:VEVENT\r\n', content)
+        self.assertEqual(content.count('BEGIN:VEVENT'), 3)
+        self.assertEqual(content.count('END:VEVENT'), 3)
+        self.assertNotIn('X-WR-CALNAME', content)
+
+    def test_rebuilt_when_member_changed(self):
+        composite = CompositeCalendar.objects.create(user=self.user, name='managers')
+        composite.members.set(self.configs)
+        composite.refresh_from_db()
+        self.assertFalse(build_composite(composite))
+
+        self.generate(self.configs[1], [4])
+        composite.refresh_from_db()
+        content = self.read_composite(composite)
+        self.assertIn('team2 issue 4', content)
+        self.assertNotIn('team2 issue 3', content)
+        self.assertEqual(composite.member_hashes[str(self.configs[1].pk)], self.configs[1].content_hash)
+
+        self.configs[0].delete()
+        self.assertNotIn('team1', self.read_composite(composite))
+
+    def test_cleared_from_configuration(self):
+        composite = CompositeCalendar.objects.create(user=self.user, name='managers')
+        composite.members.set(self.configs)
+        self.configs[0].composites.clear()
+        content = self.read_composite(composite)
+        self.assertNotIn('team1', content)
+        self.assertIn('team2 issue 3', content)
+
+    def test_rename_and_delete(self):
+        self.client.login(username='tester', password='test')
+        self.client.post(reverse('core:composite.add'), {'name': 'managers',
+                                                         'members': [config.pk for config in self.configs]})
+        composite = CompositeCalendar.objects.get()
+        directory = f'{MEDIA_ROOT}/{composite.read_token}'
+        self.assertIn('managers.ics.gz', os.listdir(directory))
+
+        with mock.patch('core.views.build_composite', wraps=build_composite) as build:
+            self.client.post(reverse('core:composite.update', args=[composite.pk]),
+                             {'name': 'managers', 'members': [self.configs[0].pk]})
+            build.assert_not_called()
+            self.client.post(reverse('core:composite.update', args=[composite.pk]),
+                             {'name': 'leads', 'members': [self.configs[0].pk]})
+            build.assert_called_once()
+        # the precompressed variants are renamed as well
+        self.assertIn('leads.ics.gz', os.listdir(directory))
+        self.assertFalse([name for name in os.listdir(directory) if name.startswith('managers')])
+        self.assertEqual(self.read_composite(CompositeCalendar.objects.get()).count('BEGIN:VEVENT'), 2)
+
+        self.client.post(reverse('core:composite.delete', args=[composite.pk]))
+        self.assertFalse(CompositeCalendar.objects.exists())
+        self.assertEqual(os.listdir(directory), [])
+
+    def test_show_file(self):
+        self.client.login(username='tester', password='test')
+        response = self.client.post(reverse('core:composite.add'), {'name': 'managers',
+                                                                     'members': [config.pk for config in self.configs]})
+        composite = CompositeCalendar.objects.get()
+        self.assertRedirects(response, reverse('core:composite.detail', args=[composite.pk]))
+        url = reverse('core:ics.show', args=[composite.read_token, 'managers.ics'])
+        self.client.logout()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], f'"{composite.content_hash}"')
+        self.assertEqual(response.content.decode().count('BEGIN:VEVENT'), 3)
+        self.assertEqual(self.client.get(url, {'past_days': 10}).status_code, 400)
+
+    def test_foreign_members(self):
+        other = User.objects.create_user('other', password='test')
+        self.client.login(username='other', password='test')
+        response = self.client.post(reverse('core:composite.add'), {'name': 'stolen',
+                                                                     'members': [self.configs[0].pk]})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(CompositeCalendar.objects.filter(user=other).exists())
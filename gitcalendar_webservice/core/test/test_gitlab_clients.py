@@ -0,0 +1,46 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from core.gitlab_clients import clients
+from core.models import GitLabAPI
+
+
+@mock.patch('gitlab.Gitlab.auth')
+class GitLabClientRegistryTests(TestCase):
+    def setUp(self) -> None:
+        User.objects.create_user('tester', password='test')
+        self.api = GitLabAPI.objects.create(
+            user=User.objects.get(username='tester'),
+            api_name='api from tester',
+            url='https://example.org/',
+            gitlab_api_token='mytesttoken'
+        )
+        clients.clear()
+
+    def test_client_is_reused(self, auth):
+        client = clients.get(self.api)
+        self.assertIs(clients.get(GitLabAPI.objects.get(pk=self.api.pk)), client)
+        self.assertEqual(auth.call_count, 1)
+
+    @override_settings(GITCALENDAR_CLIENT_AUTH_TTL=-1)
+    def test_auth_expires(self, auth):
+        client = clients.get(self.api)
+        self.assertIs(clients.get(self.api), client)
+        self.assertEqual(auth.call_count, 2)
+
+    def test_client_dropped_on_edit(self, auth):
+        client = clients.get(self.api)
+        self.api.gitlab_api_token = 'mynewtesttoken'
+        self.api.save()
+        new_client = clients.get(self.api)
+        self.assertIsNot(new_client, client)
+        self.assertEqual(new_client.private_token, 'mynewtesttoken')
+
+    def test_client_dropped_on_delete(self, auth):
+        client = clients.get(self.api)
+        pk = self.api.pk
+        self.api.delete()
+        self.api.pk = pk
+        self.assertIsNot(clients.get(self.api), client)
@@ -0,0 +1,98 @@
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from core.calendar_generator import generator
+from core.jobs import LEASE_RETRY_DELAY, enqueue_generation, run_job
+from core.leases import GenerationInProgress, acquire_lease, generation_lease, release_lease
+from core.models import GitLabAPI, CalendarConfiguration, GenerationJob
+
+
+class GenerationLeaseTests(TestCase):
+    def setUp(self) -> None:
+        User.objects.create_user('tester', password='test')
+        GitLabAPI.objects.create(
+            user=User.objects.get(username='tester'),
+            api_name='api from tester',
+            url='https://example.org/',
+            gitlab_api_token='mytesttoken'
+        )
+        self.config = CalendarConfiguration.objects.create(
+            user=User.objects.get(username='tester'),
+            api_id=1,
+            config_name='config1'
+        )
+        self.config.set_project_ids('1')
+
+    def test_lease(self):
+        self.assertTrue(acquire_lease(self.config, 'node1'))
+        self.assertFalse(acquire_lease(self.config, 'node2'))
+        self.assertTrue(acquire_lease(self.config, 'node1'))
+        release_lease(self.config, 'node2')
+        self.assertFalse(acquire_lease(self.config, 'node2'))
+        release_lease(self.config, 'node1')
+        self.assertTrue(acquire_lease(self.config, 'node2'))
+
+    def test_expired_lease(self):
+        acquire_lease(self.config, 'node1')
+        CalendarConfiguration.objects.filter(pk=self.config.pk) \
+            .update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(acquire_lease(self.config, 'node2'))
+
+    def test_generation_lease(self):
+        with generation_lease(self.config):
+            self.assertNotEqual(CalendarConfiguration.objects.get(pk=self.config.pk).lease_owner, '')
+        self.assertEqual(CalendarConfiguration.objects.get(pk=self.config.pk).lease_owner, '')
+
+    def test_lease_renewed(self):
+        leases = CalendarConfiguration.objects.filter(pk=self.config.pk)
+        now = time.monotonic()
+        with generation_lease(self.config) as renew, mock.patch('core.leases.time.monotonic') as monotonic:
+            expires_at = leases.get().lease_expires_at
+            monotonic.return_value = now + 1
+            renew()
+            self.assertEqual(leases.get().lease_expires_at, expires_at)
+
+            monotonic.return_value += settings.GITCALENDAR_GENERATION_LEASE
+            renew()
+            self.assertGreater(leases.get().lease_expires_at, expires_at)
+
+            leases.update(lease_owner='node2')
+            monotonic.return_value += settings.GITCALENDAR_GENERATION_LEASE
+            with self.assertRaises(GenerationInProgress):
+                renew()
+
+    @mock.patch('core.calendar_generator.clients')
+    def test_generation_elsewhere(self, clients):
+        acquire_lease(self.config, 'node2')
+        with self.assertRaises(GenerationInProgress):
+            generator(self.config)
+        clients.get.assert_not_called()
+
+        job = enqueue_generation(self.config)
+        job.status = GenerationJob.RUNNING
+        job.save()
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, GenerationJob.QUEUED)
+        self.assertGreater(job.run_after, timezone.now())
+
+    @mock.patch('core.calendar_generator.clients')
+    def test_retry_merged_into_queued_job(self, clients):
+        acquire_lease(self.config, 'node2')
+        job = enqueue_generation(self.config)
+        GenerationJob.objects.filter(pk=job.pk).update(status=GenerationJob.RUNNING, started_at=timezone.now())
+        job.refresh_from_db()
+        queued = enqueue_generation(self.config, delay=3600)
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, GenerationJob.FAILED)
+        self.assertIn(f'Merged into the queued job {queued.pk}', job.error)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, GenerationJob.QUEUED)
+        self.assertLessEqual(queued.run_after, timezone.now() + timedelta(seconds=LEASE_RETRY_DELAY))
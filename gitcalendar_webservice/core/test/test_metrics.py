@@ -0,0 +1,35 @@
+from django.test import SimpleTestCase
+
+from core.metrics import MetricsRegistry
+
+
+class MetricsRegistryTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.metrics = MetricsRegistry()
+
+    def test_counter(self):
+        self.metrics.inc('gitcalendar_generations_total', host='gitlab.example.org')
+        self.metrics.inc('gitcalendar_events_total', 12, host='gitlab.example.org')
+        self.metrics.inc('gitcalendar_events_total', 3, host='gitlab.example.org')
+        output = self.metrics.render()
+        self.assertIn('# TYPE gitcalendar_events_total counter', output)
+        self.assertIn('gitcalendar_generations_total{host="gitlab.example.org"} 1\n', output)
+        self.assertIn('gitcalendar_events_total{host="gitlab.example.org"} 15\n', output)
+
+    def test_histogram(self):
+        self.metrics.observe('gitcalendar_generation_phase_seconds', 0.2, host='a', phase='fetch')
+        self.metrics.observe('gitcalendar_generation_phase_seconds', 300, host='a', phase='fetch')
+        output = self.metrics.render()
+        self.assertIn('gitcalendar_generation_phase_seconds_bucket{host="a",phase="fetch",le="0.1"} 0\n', output)
+        self.assertIn('gitcalendar_generation_phase_seconds_bucket{host="a",phase="fetch",le="0.25"} 1\n', output)
+        self.assertIn('gitcalendar_generation_phase_seconds_bucket{host="a",phase="fetch",le="+Inf"} 2\n', output)
+        self.assertIn('gitcalendar_generation_phase_seconds_sum{host="a",phase="fetch"} 300.2\n', output)
+        self.assertIn('gitcalendar_generation_phase_seconds_count{host="a",phase="fetch"} 2\n', output)
+
+    def test_label_escaping(self):
+        self.metrics.inc('gitcalendar_generations_total', host='a"b\\c')
+        self.assertIn('gitcalendar_generations_total{host="a\\"b\\\\c"} 1\n', self.metrics.render())
+
+    def test_unknown_metric(self):
+        with self.assertRaises(KeyError):
+            self.metrics.inc('unknown_total')
@@ -1,7 +1,8 @@
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.test import TestCase
-from core.models import GitLabAPI, CalendarConfiguration
+from core.forms import CalendarConfigurationForm
+from core.models import GitLabAPI, CalendarConfiguration, CalendarMembership
 
 
 class GitLabAPITests(TestCase):
@@ -48,16 +49,16 @@ class CalendarConfigTests(TestCase):
         CalendarConfiguration.objects.create(
             user=User.objects.get(username='tester'),
             api_id=1,
-            config_name='test1',
-            projects='28236929'
-        )
+            config_name='test1'
+        ).set_project_ids('28236929')
 
     def test_calendarconfig_ok(self):
-        calendar_config = CalendarConfiguration(user_id=1, api_id=1, config_name='test config',
-                                                projects='10076', only_issues=True)
+        calendar_config = CalendarConfiguration(user_id=1, api_id=1, config_name='test config', only_issues=True)
         calendar_config.full_clean()
         calendar_config.save()
+        calendar_config.set_project_ids('10076')
         expected_config = CalendarConfiguration.objects.get(pk=2)
+        self.assertEqual(expected_config.get_project_ids(), {10076})
         self.assertEqual(expected_config.config_name, 'test config')
         self.assertEqual(expected_config.api.api_name, 'api from tester')
         self.assertEqual(expected_config.user.username, 'tester')
@@ -70,10 +71,35 @@ class CalendarConfigTests(TestCase):
         self.assertEqual(ve.exception.messages[0], 'This field cannot be null.')
         self.assertEqual(ve.exception.messages[1], 'This field cannot be null.')
         self.assertEqual(ve.exception.messages[2], 'This field cannot be blank.')
-        self.assertEqual(ve.exception.messages[3], 'Please provide an entry for at least one project/group')
-        self.assertEqual(ve.exception.messages[4], 'Please provide an entry for at least one project/group')
+        form = CalendarConfigurationForm({'config_name': 'test config', 'api': 1, 'projects': ' ', 'groups': ''})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['projects'], ['Please provide an entry for at least one project/group'])
+        self.assertEqual(form.errors['groups'], ['Please provide an entry for at least one project/group'])
 
     def test_calendarconfig_deletion(self):
         self.assertTrue(CalendarConfiguration.objects.filter(pk=1).exists())
         CalendarConfiguration.objects.get(pk=1).delete()
         self.assertFalse(CalendarConfiguration.objects.filter(pk=1).exists())
+
+    def test_calendarconfig_memberships(self):
+        project_ids = ','.join(str(pid) for pid in range(10000000, 10000040))
+        calendar_config = CalendarConfiguration.objects.create(user_id=1, api_id=1, config_name='many projects')
+        calendar_config.set_project_ids(project_ids)
+        calendar_config.set_group_ids('7,x')
+        calendar_config = CalendarConfiguration.objects.get(pk=calendar_config.pk)
+        self.assertEqual(calendar_config.projects, project_ids)
+        self.assertEqual(calendar_config.get_group_ids(), {7})
+        self.assertEqual(calendar_config.memberships.count(), 41)
+
+        # the stored path of a kept group stays
+        calendar_config.memberships.filter(kind=CalendarMembership.GROUP).update(path='team')
+        calendar_config.set_group_ids('7,8')
+        self.assertEqual(list(calendar_config.memberships.filter(kind=CalendarMembership.GROUP).values_list(
+            'gitlab_id', 'path')), [(7, 'team'), (8, '')])
+
+        calendar_config.set_group_ids('')
+        self.assertIsNone(CalendarConfiguration.objects.get(pk=calendar_config.pk).get_group_ids())
+        self.assertEqual(CalendarConfiguration.objects.get(pk=calendar_config.pk).projects, project_ids)
+        self.assertEqual(list(CalendarConfiguration.objects.filter(
+            memberships__kind=CalendarMembership.PROJECT, memberships__gitlab_id=28236929)),
+            [CalendarConfiguration.objects.get(pk=1)])
@@ -0,0 +1,81 @@
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core.models import GitLabAPI, CalendarConfiguration, GenerationJob, CompositeCalendar
+from core.views import LIST_PAGE_SIZE
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class QueryBudgetTests(TestCase):
+    """
+    The number of queries of a page does not grow with the number of rows it shows
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_superuser('tester', password='123')
+        self.api = GitLabAPI.objects.create(user=self.user, api_name='api', url='https://example.org/',
+                                            gitlab_api_token='mytesttoken')
+        self.composite = CompositeCalendar.objects.create(user=self.user, name='composite')
+        self.add_rows(2)
+        self.client.login(username='tester', password='123')
+
+    def add_rows(self, count):
+        for number in range(count):
+            api = GitLabAPI.objects.create(user=self.user, api_name=f'api{number}', url='https://example.org/',
+                                           gitlab_api_token='mytesttoken')
+            for owner in (self.api, api):
+                config = CalendarConfiguration.objects.create(user=self.user, api=owner, config_name=f'config{number}')
+                config.set_project_ids('1')
+                GenerationJob.objects.create(configuration=config)
+                self.composite.members.add(config)
+            CompositeCalendar.objects.create(user=self.user, name=f'composite{number}').members.add(config)
+
+    def assertConstantQueries(self, url, budget):
+        """
+        Requests the page with few and with many rows, both have to stay within the budget
+        """
+        self.client.get(url)
+        with self.assertNumQueries(budget):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.add_rows(10)
+        with self.assertNumQueries(budget):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_list_views(self):
+        self.assertConstantQueries(reverse('core:gitlabapi.list'), 5)
+        self.assertConstantQueries(reverse('core:calendar.list'), 5)
+        self.assertConstantQueries(reverse('core:composite.list'), 5)
+
+    def test_detail_views(self):
+        config = self.api.configurations.first()
+        self.assertConstantQueries(reverse('core:gitlabapi.detail', args=[self.api.pk]), 3)
+        self.assertConstantQueries(reverse('core:gitlabapi.delete', args=[self.api.pk]), 4)
+        self.assertConstantQueries(reverse('core:calendar.detail', args=[config.pk]), 5)
+        self.assertConstantQueries(reverse('core:calendar.update', args=[config.pk]), 5)
+        self.assertConstantQueries(reverse('core:composite.detail', args=[self.composite.pk]), 4)
+
+    def test_admin(self):
+        self.assertConstantQueries(reverse('admin:core_gitlabapi_changelist'), 6)
+        self.assertConstantQueries(reverse('admin:core_calendarconfiguration_changelist'), 6)
+        self.assertConstantQueries(reverse('admin:core_generationjob_changelist'), 5)
+        self.assertConstantQueries(reverse('admin:core_compositecalendar_changelist'), 6)
+        self.assertConstantQueries(reverse('admin:core_gitlabapi_change', args=[self.api.pk]), 8)
+
+    def test_pagination(self):
+        self.add_rows(LIST_PAGE_SIZE)
+        response = self.client.get(reverse('core:calendar.list'))
+        self.assertEqual(len(response.context['object_list']), LIST_PAGE_SIZE)
+        self.assertContains(response, '?page=2')
+        response = self.client.get(reverse('core:calendar.list'), {'page': 3})
+        self.assertEqual(len(response.context['object_list']), 4)
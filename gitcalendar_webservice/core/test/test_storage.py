@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.http import Http404
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from core.calendar_cache import calendar_cache
+from core.calendar_generator import CALENDAR_FOOTER, CALENDAR_HEADER, write_calendar
+from core.models import GitLabAPI, CalendarConfiguration
+from core.storage import LocalCalendarStorage, SharedDirectoryStorage, calendar_name, calendar_storage
+
+MEDIA_ROOT = tempfile.mkdtemp()
+SHARED_DIR = tempfile.mkdtemp()
+
+
+class CalendarStorageTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_local_storage_replaces(self):
+        storage = LocalCalendarStorage(location=self.directory)
+        self.assertEqual(storage.save('token/a.ics', ContentFile(b'first')), 'token/a.ics')
+        self.assertEqual(storage.save('token/a.ics', ContentFile(b'second')), 'token/a.ics')
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'token')), ['a.ics'])
+        self.assertEqual(os.stat(storage.path('token/a.ics')).st_mode & 0o777, 0o644)
+        with storage.open('token/a.ics') as file:
+            self.assertEqual(file.read(), b'second')
+
+    def test_shared_directory_storage(self):
+        storage = SharedDirectoryStorage(location=self.directory)
+        storage.save('token/a.ics', ContentFile(b'first'))
+        storage.save('token/a.ics', ContentFile(b'second'))
+        self.assertTrue(storage.exists('token/a.ics'))
+        self.assertEqual(storage.size('token/a.ics'), 6)
+        with self.assertRaises(NotImplementedError):
+            storage.path('token/a.ics')
+        storage.delete('token/a.ics')
+        storage.delete('token/a.ics')
+        self.assertFalse(storage.exists('token/a.ics'))
+
+    def test_calendar_name(self):
+        self.assertEqual(calendar_name('token', 'a.ics'), 'token/a.ics')
+        for filename in ('..', '.', '', '../a.ics', 'a\\b.ics'):
+            with self.assertRaises(Http404):
+                calendar_name('token', filename)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, GITCALENDAR_STORAGE='core.storage.SharedDirectoryStorage',
+                   GITCALENDAR_STORAGE_OPTIONS={'location': SHARED_DIR})
+class SharedDirectoryViewTests(TestCase):
+    def setUp(self) -> None:
+        User.objects.create_user('tester1', password='123')
+        GitLabAPI.objects.create(
+            user=User.objects.get(username='tester1'),
+            api_name='api from tester1',
+            url='https://example.org/',
+            gitlab_api_token='mytesttoken'
+        )
+        self.config = CalendarConfiguration.objects.create(
+            user=User.objects.get(username='tester1'),
+            api_id=1,
+            config_name='config1'
+        )
+        self.config.set_project_ids('28236929')
+        self.config.content_hash = write_calendar(self.config, CALENDAR_HEADER + CALENDAR_FOOTER)
+        self.config.save()
+        self.url = reverse('core:ics.show', args=[self.config.read_token, 'config1.ics'])
+        calendar_cache.clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        shutil.rmtree(SHARED_DIR, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_written_to_shared_directory(self):
+        self.assertIsInstance(calendar_storage._wrapped, SharedDirectoryStorage)
+        self.assertTrue(os.path.isfile(f'{SHARED_DIR}/{self.config.read_token}/config1.ics'))
+        self.assertFalse(os.path.exists(f'{MEDIA_ROOT}/{self.config.read_token}'))
+
+    def test_show_file(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], f'"{self.config.content_hash}-gzip"')
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(GITCALENDAR_SENDFILE='x-sendfile')
+    def test_x_sendfile_needs_paths(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.client.get(self.url)
@@ -0,0 +1,65 @@
+import shutil
+import tempfile
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase, override_settings
+from requests.adapters import HTTPAdapter
+
+from core.throttle import HostThrottle, ThrottledAdapter, throttle
+
+THROTTLE_DIR = tempfile.mkdtemp()
+
+
+def make_response(status_code=200, **headers):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers)
+    response.raw = mock.Mock()
+    return response
+
+
+@override_settings(GITCALENDAR_THROTTLE_DIR=THROTTLE_DIR, GITCALENDAR_THROTTLE_RATE=2, GITCALENDAR_THROTTLE_RETRIES=2)
+@mock.patch('core.throttle.time.sleep')
+class HostThrottleTests(SimpleTestCase):
+    def setUp(self) -> None:
+        shutil.rmtree(THROTTLE_DIR, ignore_errors=True)
+        self.throttle = HostThrottle()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(THROTTLE_DIR, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_bucket(self, sleep):
+        self.assertEqual(self.throttle.acquire('example.org'), 0)
+        self.assertEqual(self.throttle.acquire('example.org'), 0)
+        self.assertGreater(self.throttle.acquire('example.org'), 0.4)
+        sleep.assert_called_once()
+        self.assertEqual(self.throttle.acquire('other.org'), 0)
+        self.assertEqual(self.throttle.stats()['example.org']['throttled_requests'], 1)
+        self.assertEqual(self.throttle.stats()['example.org']['requests'], 3)
+
+    def test_bucket_shared(self, sleep):
+        self.throttle.acquire('example.org')
+        self.throttle.acquire('example.org')
+        self.assertGreater(HostThrottle().acquire('example.org'), 0.4)
+
+    def test_retry_after(self, sleep):
+        self.throttle.update('example.org', make_response(429, **{'Retry-After': '30'}))
+        self.assertGreater(self.throttle.acquire('example.org'), 29)
+        self.assertEqual(self.throttle.stats()['example.org']['rate_limited_responses'], 1)
+
+    def test_rate_limit_headers(self, sleep):
+        self.throttle.update('example.org', make_response(**{'RateLimit-Limit': '60', 'RateLimit-Remaining': '10'}))
+        self.assertEqual(self.throttle.acquire('example.org'), 0)
+        self.assertGreater(self.throttle.acquire('example.org'), 0.9)
+
+    def test_adapter_retries_rate_limited_requests(self, sleep):
+        responses = [make_response(429, **{'Retry-After': '1'}), make_response(200)]
+        request = requests.Request('GET', 'https://throttled.example.org/api/v4/projects').prepare()
+        with mock.patch.object(HTTPAdapter, 'send', side_effect=responses) as send:
+            response = ThrottledAdapter().send(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(send.call_count, 2)
+        self.assertGreater(throttle.stats()['throttled.example.org']['throttled_seconds'], 0.9)
@@ -1,9 +1,31 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import date, datetime, timedelta
+from unittest import mock
+
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.db import IntegrityError, transaction
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.urls import reverse
 from django.utils.encoding import escape_uri_path
+from django.utils.http import http_date
+
+from gitlab import GitlabAuthenticationError
+
+from core.calendar_cache import calendar_cache
+from core.calendar_generator import CALENDAR_HEADER, CALENDAR_FOOTER, write_calendar
+from core import jobs
+from core.jobs import claim_next_job, enqueue_generation, run_pending_jobs
+from core.leases import acquire_lease, release_lease
+from core.models import GitLabAPI, CalendarConfiguration, GenerationJob, CalendarEvent
 
-from core.models import GitLabAPI, CalendarConfiguration
+MEDIA_ROOT = tempfile.mkdtemp()
 
 
 class LoginTests(TestCase):
@@ -176,15 +198,13 @@ class CalendarConfigurationViewTests(TestCase):
         CalendarConfiguration.objects.create(
             user=User.objects.get(username='tester1'),
             api_id=1,
-            config_name='config from tester1',
-            projects='28236929,abcd'
-        )
+            config_name='config from tester1'
+        ).set_project_ids('28236929,abcd')
         CalendarConfiguration.objects.create(
             user=User.objects.get(username='tester2'),
             api_id=2,
-            config_name='config from tester2',
-            projects='28236929,abc'
-        )
+            config_name='config from tester2'
+        ).set_project_ids('28236929,abc')
         self.update1 = {
             "api": 1,
             "projects": "28236929,abcdefg",
@@ -288,6 +308,7 @@ class CalendarConfigurationViewTests(TestCase):
         config1 = CalendarConfiguration.objects.get(pk=3)
         self.assertEqual(config1.user.username, 'tester1')
         self.assertEqual(config1.api_id, 1)
+        self.assertEqual(config1.projects, '28236929')
 
     def test_own_calendarconfig_deletion_views(self):
         """
@@ -323,23 +344,445 @@ class ICSFileCreationViews(TestCase):
         CalendarConfiguration.objects.create(
             user=User.objects.get(username='tester1'),
             api_id=1,
-            config_name='config from tester1',
-            projects='28236929,abcd'
-        )
+            config_name='config from tester1'
+        ).set_project_ids('28236929,abcd')
 
-    def test_not_valid_config_not_logged_in(self):
+    def test_generation_queued_not_logged_in(self):
         config = CalendarConfiguration.objects.get(pk=1)
         response = self.client.get(reverse('core:ics.generate', args=[config.write_token]))
-        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'queued')
+        self.assertEqual(GenerationJob.objects.get(pk=response.json()['job']).configuration, config)
 
-    def test_not_valid_config_logged_in(self):
+    def test_generation_queued_logged_in(self):
         result = self.client.login(username='tester1', password='123')
         self.assertTrue(result)
         config = CalendarConfiguration.objects.get(pk=1)
         response = self.client.get(reverse('core:ics.generate', args=[config.write_token]))
-        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.status_code, 202)
+        response = self.client.get(reverse('core:ics.generate', args=[config.write_token]))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(GenerationJob.objects.count(), 1)
+
+    def test_generation_from_browser(self):
+        config = CalendarConfiguration.objects.get(pk=1)
+        response = self.client.get(reverse('core:ics.generate', args=[config.write_token]),
+                                   HTTP_ACCEPT='text/html,application/xhtml+xml,*/*;q=0.8')
+        self.assertRedirects(response, reverse('core:calendar.detail', args=[config.pk]), fetch_redirect_response=False)
+        self.assertEqual(GenerationJob.objects.filter(status=GenerationJob.QUEUED).count(), 1)
+
+        self.client.login(username='tester1', password='123')
+        response = self.client.get(reverse('core:calendar.detail', args=[config.pk]))
+        self.assertContains(response, 'Last generation')
+        self.assertContains(response, 'Queued')
+
+    def test_generation_joins_running_job(self):
+        config = CalendarConfiguration.objects.get(pk=1)
+        job_id = self.client.get(reverse('core:ics.generate', args=[config.write_token])).json()['job']
+        self.assertEqual(claim_next_job().pk, job_id)
+        response = self.client.get(reverse('core:ics.generate', args=[config.write_token]))
+        self.assertEqual(response.json()['job'], job_id)
+        self.assertEqual(response.json()['status'], 'running')
+        # changes reported by a webhook are not covered by the running job
+        self.assertNotEqual(enqueue_generation(config).pk, job_id)
+        self.assertEqual(GenerationJob.objects.count(), 2)
+
+    def test_generation_ignores_abandoned_job(self):
+        config = CalendarConfiguration.objects.get(pk=1)
+        job_id = self.client.get(reverse('core:ics.generate', args=[config.write_token])).json()['job']
+        claim_next_job()
+        GenerationJob.objects.filter(pk=job_id).update(started_at=timezone.now() - timedelta(hours=1))
+        response = self.client.get(reverse('core:ics.generate', args=[config.write_token]))
+        self.assertNotEqual(response.json()['job'], job_id)
+        self.assertEqual(response.json()['status'], 'queued')
+
+    def test_one_queued_job_per_configuration(self):
+        config = CalendarConfiguration.objects.get(pk=1)
+        job = enqueue_generation(config)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            GenerationJob.objects.create(configuration=config)
+
+        # another process queued a job after the lookup of this one
+        with mock.patch.object(QuerySet, 'first', return_value=None):
+            self.assertEqual(enqueue_generation(config).pk, job.pk)
+        self.assertEqual(GenerationJob.objects.count(), 1)
+
+    def test_abandoned_job_reaped(self):
+        config = CalendarConfiguration.objects.get(pk=1)
+        job = enqueue_generation(config)
+        claim_next_job()
+        GenerationJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=1))
+        # the worker of a long generation still holds the lease of the configuration
+        acquire_lease(config, 'worker')
+        self.assertIsNone(claim_next_job())
+        self.assertEqual(GenerationJob.objects.get(pk=job.pk).status, GenerationJob.RUNNING)
+
+        release_lease(config, 'worker')
+        self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, GenerationJob.FAILED)
+        self.assertEqual(job.error, 'The worker stopped during the generation')
+        self.assertIsNotNone(job.finished_at)
+
+    def test_generation_unknown_token(self):
+        response = self.client.get(reverse('core:ics.generate', args=[uuid.uuid4()]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_generation_job_status(self):
+        config = CalendarConfiguration.objects.get(pk=1)
+        job_id = self.client.get(reverse('core:ics.generate', args=[config.write_token])).json()['job']
+        with mock.patch('core.jobs.generator', side_effect=GitlabAuthenticationError()):
+            self.assertEqual(run_pending_jobs(), 1)
+        response = self.client.get(reverse('core:ics.job', args=[config.write_token, job_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'failed')
+        self.assertEqual(response.json()['error'], 'GitLab Authentication failed')
+        response = self.client.get(reverse('core:ics.job', args=[config.read_token, job_id]))
+        self.assertEqual(response.status_code, 404)
+
+        job_id = self.client.get(reverse('core:ics.generate', args=[config.write_token])).json()['job']
+        with mock.patch('core.jobs.generator'):
+            self.assertEqual(run_pending_jobs(), 1)
+        response = self.client.get(reverse('core:ics.job', args=[config.write_token, job_id]))
+        self.assertEqual(response.json()['status'], 'done')
+        self.assertTrue(CalendarConfiguration.objects.get(pk=1).file_exists)
+
+        self.client.login(username='tester1', password='123')
+        response = self.client.get(reverse('core:calendar.detail', args=[1]))
+        self.assertContains(response, 'Last generation')
+        self.assertContains(response, 'Done')
 
     def test_get_ics_file_not_logged_in(self):
         config = CalendarConfiguration.objects.get(pk=1)
         self.assertURLEqual(reverse('core:ics.show', args=[config.read_token, config.config_name + '.ics']),
                             escape_uri_path(f'/ics/show/{str(config.read_token)}/{str(config.config_name)}.ics'))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ICSFileShowViews(TestCase):
+    def setUp(self) -> None:
+        User.objects.create_user('tester1', password='123')
+        GitLabAPI.objects.create(
+            user=User.objects.get(username='tester1'),
+            api_name='api from tester1',
+            url='https://example.org/',
+            gitlab_api_token='mytesttoken'
+        )
+        self.config = CalendarConfiguration.objects.create(
+            user=User.objects.get(username='tester1'),
+            api_id=1,
+            config_name='config1'
+        )
+        self.config.set_project_ids('28236929')
+        self.config.content_hash = write_calendar(self.config, CALENDAR_HEADER + CALENDAR_FOOTER)
+        self.config.save()
+        self.url = reverse('core:ics.show', args=[self.config.read_token, 'config1.ics'])
+        calendar_cache.clear()
+        jobs._stale_checks.clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_show_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], f'"{self.config.content_hash}"')
+        self.assertIn('Last-Modified', response)
+        self.assertIn(b'BEGIN:VCALENDAR', b''.join(response))
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        with mock.patch('builtins.open') as file_open:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 304)
+            file_open.assert_not_called()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"outdated"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_file(self):
+        response = self.client.get(reverse('core:ics.show', args=[self.config.read_token, 'other.ics']))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('core:ics.show', args=[self.config.read_token, '..']))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(GITCALENDAR_SENDFILE='x-accel-redirect', GITCALENDAR_SENDFILE_URL='/internal/')
+    def test_x_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/internal/{self.config.read_token}/config1.ics')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], f'"{self.config.content_hash}"')
+
+    @override_settings(GITCALENDAR_SENDFILE='x-sendfile')
+    def test_x_sendfile(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['X-Sendfile'].endswith(f'{self.config.read_token}/config1.ics'))
+        response = self.client.get(reverse('core:ics.show', args=[self.config.read_token, 'other.ics']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_precompressed_variant(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], f'"{self.config.content_hash}-gzip"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn(b'BEGIN:VCALENDAR', gzip.decompress(b''.join(response)))
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_IF_NONE_MATCH=f'"{self.config.content_hash}-gzip"')
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_outdated_variant_ignored(self):
+        path = f'{MEDIA_ROOT}/{self.config.read_token}/config1.ics'
+        os.utime(path + '.gz', ns=(0, 0))
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_cached_file(self):
+        self.client.get(self.url)
+        response = self.client.get(self.url)
+        self.assertFalse(response.streaming)
+        self.assertEqual(calendar_cache.stats()['hits'], 1)
+        self.assertEqual(calendar_cache.stats()['misses'], 1)
+        write_calendar(self.config, CALENDAR_HEADER + 'X-CHANGED:1\r\n' + CALENDAR_FOOTER)
+        self.assertEqual(calendar_cache.stats()['entries'], 0)
+        self.assertIn(b'X-CHANGED', self.client.get(self.url).content)
+
+    def test_unchanged_calendar_not_rewritten(self):
+        path = f'{MEDIA_ROOT}/{self.config.read_token}/config1.ics'
+        os.utime(path, (1600000000, 1600000000))
+        last_modified = self.client.get(self.url)['Last-Modified']
+        self.assertEqual(write_calendar(self.config, CALENDAR_HEADER + CALENDAR_FOOTER), self.config.content_hash)
+        self.assertEqual(os.stat(path).st_mtime, 1600000000)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        content_hash = write_calendar(self.config, CALENDAR_HEADER + 'X-CHANGED:1\r\n' + CALENDAR_FOOTER)
+        self.assertNotEqual(content_hash, self.config.content_hash)
+        self.assertGreater(os.stat(path).st_mtime, 1600000000)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(path))), ['config1.ics', 'config1.ics.gz'])
+
+    def test_windowed_feed(self):
+        for number, start in enumerate(['2020-01-01', '2021-06-01', '2021-06-30', '2022-01-01']):
+            CalendarEvent.objects.create(configuration=self.config, object_type=CalendarEvent.ISSUE,
+                                         object_id=number, start=start, end=start, title=f'event {number}')
+        response = self.client.get(self.url, {'from': '2021-06-01', 'to': '2021-06-30'},
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response['ETag'], f'"{self.config.content_hash}-2021-06-01..2021-06-30"')
+        content = response.content.decode()
+        self.assertNotIn('event 0', content)
+        self.assertIn('SUMMARY:event 1', content)
+        self.assertIn('SUMMARY:event 2', content)
+        self.assertNotIn('event 3', content)
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR'))
+
+        response = self.client.get(self.url, {'from': '2021-06-01', 'to': '2021-06-30'},
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.client.get(self.url, {'from': '2021-06-01', 'to': '2021-06-30'})
+        self.assertEqual(calendar_cache.stats()['hits'], 1)
+
+        with mock.patch('core.views.localdate', return_value=date(2021, 12, 31)):
+            response = self.client.get(self.url, {'past_days': '200', 'future_days': '1'})
+        self.assertEqual(response['ETag'], f'"{self.config.content_hash}-2021-06-14..2022-01-01"')
+        self.assertNotIn('event 1', response.content.decode())
+        self.assertIn('event 3', response.content.decode())
+        response = self.client.get(self.url, {'from': '2021-06-02'})
+        self.assertEqual(response.content.decode().count('BEGIN:VEVENT'), 2)
+
+    def test_relative_window_modified_daily(self):
+        response = self.client.get(self.url, {'past_days': '10'})
+        self.assertEqual(response.status_code, 200)
+        last_modified = response['Last-Modified']
+        self.assertEqual(self.client.get(self.url, {'past_days': '10'},
+                                         HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        with mock.patch('core.views.localdate', return_value=date(2100, 1, 1)):
+            response = self.client.get(self.url, {'past_days': '10'}, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Last-Modified'], http_date(timezone.make_aware(datetime(2100, 1, 1)).timestamp()))
+
+    def test_invalid_window(self):
+        self.assertEqual(self.client.get(self.url, {'from': '2021-13-01'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'past_days': 'many'}).status_code, 400)
+
+    @override_settings(GITCALENDAR_CACHE_MAX_ENTRIES=0)
+    def test_uncached_file_streamed(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        self.assertIn(b'BEGIN:VCALENDAR', b''.join(response))
+
+    def test_stale_calendar_refreshed(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.config.max_age = 10
+        self.config.generated_at = timezone.now()
+        self.config.save()
+        self.client.get(self.url)
+        self.assertEqual(GenerationJob.objects.count(), 0)
+
+        jobs._stale_checks.clear()
+        self.config.generated_at = timezone.now() - timedelta(minutes=11)
+        self.config.save()
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(GenerationJob.objects.filter(status=GenerationJob.QUEUED).count(), 1)
+        for _ in range(5):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        jobs._stale_checks.clear()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(GenerationJob.objects.count(), 1)
+
+        # a job of a crashed worker does not keep the calendar from being refreshed
+        GenerationJob.objects.update(status=GenerationJob.RUNNING, started_at=timezone.now() - timedelta(hours=1))
+        jobs._stale_checks.clear()
+        self.client.get(self.url)
+        self.assertEqual(GenerationJob.objects.filter(status=GenerationJob.QUEUED).count(), 1)
+
+
+    def test_stale_checks_expire(self):
+        with mock.patch('core.jobs.time.monotonic', return_value=1000.0) as monotonic:
+            for _ in range(10):
+                jobs.refresh_if_stale(uuid.uuid4())
+            self.assertEqual(len(jobs._stale_checks), 10)
+            monotonic.return_value += jobs.STALE_CHECK_INTERVAL
+            jobs.refresh_if_stale(self.config.read_token)
+        self.assertEqual(list(jobs._stale_checks), [self.config.read_token])
+
+
+class GitLabWebhookViews(TestCase):
+    def setUp(self) -> None:
+        User.objects.create_user('tester1', password='123')
+        self.api = GitLabAPI.objects.create(
+            user=User.objects.get(username='tester1'),
+            api_name='api from tester1',
+            url='https://example.org/',
+            gitlab_api_token='mytesttoken',
+            webhook_secret='mysecret'
+        )
+        for name, projects, groups in (('project config', '10,11', ''), ('group config', '', '5'),
+                                       ('other config', '12', '')):
+            config = CalendarConfiguration.objects.create(
+                user=User.objects.get(username='tester1'),
+                api=self.api,
+                config_name=name
+            )
+            config.set_project_ids(projects)
+            config.set_group_ids(groups)
+        # the generation stored an item of project 11 and the path of group 5
+        group_config = CalendarConfiguration.objects.get(config_name='group config')
+        CalendarEvent.objects.create(configuration=group_config, object_type=CalendarEvent.ISSUE, object_id=1,
+                                     project_id=11, start=date(2021, 9, 1), end=date(2021, 9, 2), title='issue')
+        group_config.memberships.update(path='team')
+        self.url = reverse('core:gitlab.webhook', args=[self.api.pk])
+
+    def post_event(self, payload, token='mysecret'):
+        return self.client.post(self.url, json.dumps(payload), content_type='application/json',
+                                HTTP_X_GITLAB_TOKEN=token)
+
+    def queued(self):
+        return sorted(GenerationJob.objects.values_list('configuration__config_name', flat=True))
+
+    def test_invalid_token(self):
+        response = self.post_event({'object_kind': 'issue', 'project': {'id': 10}}, token='wrong')
+        self.assertEqual(response.status_code, 403)
+        self.api.webhook_secret = ''
+        self.api.save()
+        response = self.post_event({'object_kind': 'issue', 'project': {'id': 10}}, token='')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.queued(), [])
+
+    def test_issue_event(self):
+        response = self.post_event({'object_kind': 'issue', 'project': {'id': 10},
+                                    'object_attributes': {'project_id': 10}})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.queued(), ['project config'])
+
+    def test_group_project_event(self):
+        self.post_event({'object_kind': 'issue', 'project': {'id': 11}})
+        self.assertEqual(self.queued(), ['group config', 'project config'])
+
+    def test_new_group_project_event(self):
+        other = CalendarConfiguration.objects.create(user=self.api.user, api=self.api, config_name='other group config')
+        other.set_group_ids('6')
+        other.memberships.update(path='other')
+        # a new project of a group has no items in the calendars yet, it is matched by the paths of its subgroups
+        self.post_event({'object_kind': 'issue', 'project': {'id': 13, 'path_with_namespace': 'team/sub/new'}})
+        self.assertEqual(self.queued(), ['group config'])
+        GenerationJob.objects.all().delete()
+
+        self.post_event({'object_kind': 'issue', 'project': {'id': 13, 'path_with_namespace': 'teams/new'}})
+        self.post_event({'object_kind': 'issue', 'project': {'id': 13}})
+        self.assertEqual(self.queued(), [])
+
+    def test_group_milestone_event(self):
+        self.post_event({'object_kind': 'milestone', 'object_attributes': {'group_id': 5}})
+        self.assertEqual(self.queued(), ['group config'])
+
+    def test_burst_debounced(self):
+        for _ in range(50):
+            self.post_event({'object_kind': 'milestone', 'object_attributes': {'group_id': 5}})
+        self.assertEqual(self.queued(), ['group config'])
+        job = GenerationJob.objects.get()
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIsNone(claim_next_job())
+
+    def test_ignored_event(self):
+        response = self.post_event({'object_kind': 'push', 'project': {'id': 10}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.queued(), [])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, GITCALENDAR_METRICS_TOKEN='metricstoken')
+class MetricsViews(TestCase):
+    def setUp(self) -> None:
+        User.objects.create_user('tester1', password='123')
+        User.objects.create_user('admin', password='123', is_staff=True)
+        GitLabAPI.objects.create(
+            user=User.objects.get(username='tester1'),
+            api_name='api from tester1',
+            url='https://example.org/',
+            gitlab_api_token='mytesttoken'
+        )
+        self.config = CalendarConfiguration.objects.create(
+            user=User.objects.get(username='tester1'),
+            api_id=1,
+            config_name='config1'
+        )
+        self.config.set_project_ids('28236929')
+        self.config.content_hash = write_calendar(self.config, CALENDAR_HEADER + CALENDAR_FOOTER)
+        self.config.save()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_access(self):
+        self.assertEqual(self.client.get(reverse('core:metrics')).status_code, 403)
+        self.client.login(username='tester1', password='123')
+        self.assertEqual(self.client.get(reverse('core:metrics')).status_code, 403)
+        self.client.login(username='admin', password='123')
+        self.assertEqual(self.client.get(reverse('core:metrics')).status_code, 200)
+        self.client.logout()
+        response = self.client.get(reverse('core:metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(reverse('core:metrics'), HTTP_AUTHORIZATION='Bearer metricstoken')
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics(self):
+        self.client.get(reverse('core:ics.show', args=[self.config.read_token, 'config1.ics']))
+        self.client.get(reverse('core:ics.show', args=[self.config.read_token, 'other.ics']))
+        content = self.client.get(reverse('core:metrics'), HTTP_AUTHORIZATION='Bearer metricstoken').content.decode()
+        self.assertIn('gitcalendar_written_bytes_total{host="example.org"}', content)
+        self.assertIn('gitcalendar_calendar_response_seconds_count{status="200"}', content)
+        self.assertIn('gitcalendar_calendar_response_seconds_count{status="404"}', content)
+        self.assertIn('# TYPE gitcalendar_calendar_cache_entries gauge', content)
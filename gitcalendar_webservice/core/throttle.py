@@ -0,0 +1,164 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+try:
+    import fcntl
+except ImportError:
+    # without fcntl the buckets are only shared between the threads of a process
+    fcntl = None
+
+
+def _header_float(response, name):
+    try:
+        return float(response.headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def retry_after(response):
+    """
+    Returns the seconds to wait from a Retry-After header, which is either given in seconds or as a http date
+    """
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class HostThrottle:
+    """
+    Token bucket per GitLab host. The bucket state is kept in a json file below GITCALENDAR_THROTTLE_DIR and guarded
+    by a file lock, so that all threads and processes of a host share it. The rate follows the RateLimit-* headers of
+    GitLab, Retry-After and an exhausted RateLimit-Remaining block the host until the limit is reset.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.throttled_seconds = defaultdict(float)
+        self.throttled_requests = defaultdict(int)
+        self.rate_limited_responses = defaultdict(int)
+
+    @staticmethod
+    def _path(host):
+        return os.path.join(settings.GITCALENDAR_THROTTLE_DIR, re.sub(r'[^A-Za-z0-9.-]', '_', host) + '.json')
+
+    @contextmanager
+    def _bucket(self, host):
+        os.makedirs(settings.GITCALENDAR_THROTTLE_DIR, exist_ok=True)
+        with self._lock, open(self._path(host), 'a+') as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            file.seek(0)
+            try:
+                state = json.loads(file.read() or '{}')
+            except ValueError:
+                state = {}
+            now = time.time()
+            rate = state.get('rate') or settings.GITCALENDAR_THROTTLE_RATE
+            tokens = state.get('tokens', rate)
+            # refill the bucket for the time since the last access, the capacity allows a burst of one second
+            state['tokens'] = min(rate, tokens + (now - state.get('updated', now)) * rate)
+            state['rate'] = rate
+            state['updated'] = now
+            state.setdefault('blocked_until', 0.0)
+            yield state
+            file.seek(0)
+            file.truncate()
+            file.write(json.dumps(state))
+
+    def reserve(self, host):
+        """
+        Takes a token from the bucket of the host, returns the seconds to wait until it is available
+        """
+        with self._bucket(host) as state:
+            now = state['updated']
+            # tokens are reserved, a negative balance is paid off by waiting
+            state['tokens'] -= 1
+            wait = max(state['blocked_until'] - now, -state['tokens'] / state['rate'], 0.0)
+        with self._stats_lock:
+            self.requests[host] += 1
+            if wait > 0:
+                self.throttled_seconds[host] += wait
+                self.throttled_requests[host] += 1
+        return wait
+
+    def acquire(self, host):
+        """
+        Takes a token from the bucket of the host and waits until it is available, returns the waited seconds
+        """
+        wait = self.reserve(host)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def update(self, host, response):
+        """
+        Adapts the bucket to the rate limit that GitLab reported with a response
+        """
+        limit = _header_float(response, 'RateLimit-Limit')
+        remaining = _header_float(response, 'RateLimit-Remaining')
+        reset = _header_float(response, 'RateLimit-Reset')
+        delay = retry_after(response) if response.status_code == 429 else None
+        if response.status_code == 429:
+            with self._stats_lock:
+                self.rate_limited_responses[host] += 1
+        if limit is None and delay is None and response.status_code != 429:
+            return
+        with self._bucket(host) as state:
+            now = state['updated']
+            if limit:
+                # GitLab limits are given per minute
+                state['rate'] = limit / 60
+            if remaining is not None:
+                state['tokens'] = min(state['tokens'], remaining)
+                if remaining <= 0 and reset:
+                    state['blocked_until'] = max(state['blocked_until'], reset)
+            if response.status_code == 429:
+                state['blocked_until'] = max(state['blocked_until'], now + (delay if delay is not None else 1.0))
+
+    def stats(self):
+        with self._stats_lock:
+            return {host: {'requests': self.requests[host],
+                           'throttled_seconds': self.throttled_seconds[host],
+                           'throttled_requests': self.throttled_requests[host],
+                           'rate_limited_responses': self.rate_limited_responses[host]}
+                    for host in set(self.requests) | set(self.rate_limited_responses)}
+
+
+throttle = HostThrottle()
+
+
+class ThrottledAdapter(HTTPAdapter):
+    """
+    Sends every request through the throttle of its host, rate limited requests are repeated once the host allows it
+    """
+
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).netloc
+        for attempt in range(settings.GITCALENDAR_THROTTLE_RETRIES + 1):
+            throttle.acquire(host)
+            response = super().send(request, **kwargs)
+            throttle.update(host, response)
+            if response.status_code != 429 or attempt == settings.GITCALENDAR_THROTTLE_RETRIES:
+                return response
+            response.close()
+        return response
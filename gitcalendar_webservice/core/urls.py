@@ -7,7 +7,8 @@ from core import views
 from core.views import GitLabAPIListView, GitLabAPIDetailView, GitLabAPIUpdateView, \
     GitLabAPICreateView, GitLabAPIDeleteView, CalendarConfigurationListView, \
     CalendarConfigurationDetailView, CalendarConfigurationUpdateView, CalendarConfigurationDeleteView, \
-    CalendarConfigurationCreateView
+    CalendarConfigurationCreateView, CompositeCalendarListView, CompositeCalendarDetailView, \
+    CompositeCalendarUpdateView, CompositeCalendarCreateView, CompositeCalendarDeleteView
 
 app_name = 'core'
 
@@ -27,7 +28,16 @@ urlpatterns = [
     path('calendar/<int:pk>/edit', login_required(CalendarConfigurationUpdateView.as_view()), name='calendar.update'),
     path('calendar/<int:pk>/delete', login_required(CalendarConfigurationDeleteView.as_view()), name='calendar.delete'),
     path('calendar/add/', login_required(CalendarConfigurationCreateView.as_view()), name='calendar.add'),
+    path('composite/', CompositeCalendarListView.as_view(), name='composite.list'),
+    path('composite/<int:pk>/', login_required(CompositeCalendarDetailView.as_view()), name='composite.detail'),
+    path('composite/<int:pk>/edit', login_required(CompositeCalendarUpdateView.as_view()), name='composite.update'),
+    path('composite/<int:pk>/delete', login_required(CompositeCalendarDeleteView.as_view()),
+         name='composite.delete'),
+    path('composite/add/', login_required(CompositeCalendarCreateView.as_view()), name='composite.add'),
     path('ics/generate/<uuid:token>/', views.calendar_generating, name='ics.generate'),
+    path('ics/generate/<uuid:token>/jobs/<int:pk>/', views.generation_job, name='ics.job'),
+    path('hooks/gitlab/<int:pk>/', views.gitlab_webhook, name='gitlab.webhook'),
     path('ics/show/<uuid:token>/<str:filename>', views.show_file, name='ics.show'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,17 +1,40 @@
+import hmac
+import json
+import time
+from datetime import date, datetime, timedelta
+from functools import wraps
+from urllib.parse import quote, urlparse
+
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.models import User
-from django.http import HttpResponse, HttpResponseRedirect, FileResponse
+from django.http import HttpResponse, FileResponse, JsonResponse, Http404, \
+    HttpResponseForbidden
 from django.template import RequestContext
 from django.urls import reverse
+from django.utils.timezone import localdate, make_aware
 from django.views import generic
-from core.models import GitLabAPI, CalendarConfiguration
+from core.models import GitLabAPI, CalendarConfiguration, GenerationJob, CompositeCalendar
 from django.shortcuts import get_object_or_404, render, redirect
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST
+from django.views.decorators.vary import vary_on_headers
 from django.views.generic import ListView
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.mixins import UserPassesTestMixin
-from core.calendar_generator import generator
-from gitlab import GitlabGetError, GitlabAuthenticationError
+from core.calendar_cache import calendar_cache
+from core.calendar_generator import delete_calendar_file, render_calendar
+from core.composites import build_composite
+from core.forms import CalendarConfigurationForm
+from core.jobs import enqueue_generation, refresh_if_stale
+from core.metrics import metrics
+from core.storage import calendar_name, calendar_storage
+from core.webhooks import CALENDAR_EVENTS, get_affected_configurations, get_event_source
 from django.conf import settings
+from django.core.exceptions import BadRequest, ImproperlyConfigured
+
+CALENDAR_CONTENT_TYPE = 'text/plain; charset=utf-8'
+# content codings of the precompressed calendar variants, in order of preference
+COMPRESSED_ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
 
 
 def is_same_user(user1, user2):
@@ -50,33 +73,51 @@ def permission_denied(request, exception):
     return response
 
 
+# rows per page of the list views
+LIST_PAGE_SIZE = 50
+
+
+class OwnerRequiredMixin(UserPassesTestMixin):
+    """
+    Only the owner may access the object, it is fetched once for the permission check and the view itself
+    """
+    _object = None
+
+    def get_object(self, queryset=None):
+        if queryset is not None:
+            return super().get_object(queryset)
+        if self._object is None:
+            self._object = super().get_object()
+        return self._object
+
+    def test_func(self):
+        return is_same_user(self.request.user, self.get_object().user)
+
+
 class GitLabAPIListView(ListView):
     model = GitLabAPI
+    paginate_by = LIST_PAGE_SIZE
     template_name = 'gitlabapi_list.html'
 
     def get_queryset(self):
         user = get_object_or_404(User, pk=self.request.user.pk)
-        return GitLabAPI.objects.filter(user=user)
+        return GitLabAPI.objects.filter(user=user).select_related('user').order_by('pk')
 
 
-class GitLabAPIDetailView(UserPassesTestMixin, generic.DetailView):
+class GitLabAPIDetailView(OwnerRequiredMixin, generic.DetailView):
     model = GitLabAPI
+    queryset = GitLabAPI.objects.select_related('user')
     template_name = 'gitlabapi_detail.html'
 
-    def test_func(self):
-        return is_same_user(self.request.user, self.get_object().user)
-
 
-class GitLabAPIUpdateView(UserPassesTestMixin, generic.UpdateView):
+class GitLabAPIUpdateView(OwnerRequiredMixin, generic.UpdateView):
     model = GitLabAPI
+    queryset = GitLabAPI.objects.select_related('user')
     template_name = 'gitlabapi_form.html'
     fields = [
-        'api_name', 'url', 'gitlab_api_token'
+        'api_name', 'url', 'gitlab_api_token', 'webhook_secret'
     ]
 
-    def test_func(self):
-        return is_same_user(self.request.user, self.get_object().user)
-
     def get_success_url(self):
         return reverse('core:gitlabapi.detail', args=[self.object.pk])
 
@@ -85,7 +126,7 @@ class GitLabAPICreateView(generic.CreateView):
     model = GitLabAPI
     template_name = 'gitlabapi_form.html'
     fields = [
-        'api_name', 'url', 'gitlab_api_token'
+        'api_name', 'url', 'gitlab_api_token', 'webhook_secret'
     ]
 
     def form_valid(self, form):
@@ -96,43 +137,36 @@ class GitLabAPICreateView(generic.CreateView):
         return reverse('core:gitlabapi.detail', args=[self.object.pk])
 
 
-class GitLabAPIDeleteView(UserPassesTestMixin, generic.DeleteView):
+class GitLabAPIDeleteView(OwnerRequiredMixin, generic.DeleteView):
     model = GitLabAPI
+    queryset = GitLabAPI.objects.select_related('user')
     template_name = 'delete.html'
 
-    def test_func(self):
-        return is_same_user(self.request.user, self.get_object().user)
-
     def get_success_url(self):
         return reverse('core:gitlabapi.list')
 
 
 class CalendarConfigurationListView(ListView):
     model = CalendarConfiguration
+    paginate_by = LIST_PAGE_SIZE
     template_name = 'calendar_list.html'
 
     def get_queryset(self):
         user = get_object_or_404(User, pk=self.request.user.pk)
-        return CalendarConfiguration.objects.filter(user=user)
+        return CalendarConfiguration.objects.filter(user=user).select_related('user', 'api').order_by('pk')
 
 
-class CalendarConfigurationDetailView(UserPassesTestMixin, generic.DetailView):
+class CalendarConfigurationDetailView(OwnerRequiredMixin, generic.DetailView):
     model = CalendarConfiguration
+    queryset = CalendarConfiguration.objects.select_related('user', 'api').prefetch_related('memberships')
     template_name = 'calendar_detail.html'
 
-    def test_func(self):
-        return is_same_user(self.request.user, self.get_object().user)
-
 
-class CalendarConfigurationUpdateView(UserPassesTestMixin, generic.UpdateView):
+class CalendarConfigurationUpdateView(OwnerRequiredMixin, generic.UpdateView):
     model = CalendarConfiguration
+    queryset = CalendarConfiguration.objects.select_related('user', 'api').prefetch_related('memberships')
     template_name = 'calendar_form.html'
-    fields = [
-        'config_name', 'api', 'projects', 'groups', 'only_issues', 'only_milestones'
-    ]
-
-    def test_func(self):
-        return is_same_user(self.request.user, self.get_object().user)
+    form_class = CalendarConfigurationForm
 
     def get_form(self, *args, **kwargs):
         form = super().get_form(*args, **kwargs)
@@ -146,9 +180,7 @@ class CalendarConfigurationUpdateView(UserPassesTestMixin, generic.UpdateView):
 class CalendarConfigurationCreateView(generic.CreateView):
     model = CalendarConfiguration
     template_name = 'calendar_form.html'
-    fields = [
-        'config_name', 'api', 'projects', 'groups', 'only_issues', 'only_milestones'
-    ]
+    form_class = CalendarConfigurationForm
 
     # gets the apis which belong to the user
     def get_form(self, *args, **kwargs):
@@ -164,39 +196,359 @@ class CalendarConfigurationCreateView(generic.CreateView):
         return reverse('core:calendar.detail', args=[self.object.pk])
 
 
-class CalendarConfigurationDeleteView(UserPassesTestMixin, generic.DeleteView):
+class CalendarConfigurationDeleteView(OwnerRequiredMixin, generic.DeleteView):
     model = CalendarConfiguration
+    queryset = CalendarConfiguration.objects.select_related('user', 'api')
     template_name = 'delete.html'
 
-    def test_func(self):
-        return is_same_user(self.request.user, self.get_object().user)
-
     def get_success_url(self):
         return reverse('core:calendar.list')
 
 
+class CompositeCalendarListView(ListView):
+    model = CompositeCalendar
+    paginate_by = LIST_PAGE_SIZE
+    template_name = 'composite_list.html'
+
+    def get_queryset(self):
+        user = get_object_or_404(User, pk=self.request.user.pk)
+        return CompositeCalendar.objects.filter(user=user).select_related('user').order_by('pk')
+
+
+class CompositeCalendarDetailView(OwnerRequiredMixin, generic.DetailView):
+    model = CompositeCalendar
+    queryset = CompositeCalendar.objects.select_related('user')
+    template_name = 'composite_detail.html'
+
+
+class CompositeCalendarFormMixin:
+    model = CompositeCalendar
+    template_name = 'composite_form.html'
+    fields = [
+        'name', 'members'
+    ]
+
+    # offers only the configurations of the user
+    def get_form(self, *args, **kwargs):
+        form = super().get_form(*args, **kwargs)
+        form.fields['members'].queryset = CalendarConfiguration.objects.filter(user=self.request.user)
+        return form
+
+    def form_valid(self, form):
+        old_name = form.initial.get('name')
+        response = super().form_valid(form)
+        if old_name is None:
+            build_composite(self.object)
+        elif old_name != self.object.name:
+            # a renamed calendar is written under its new name only
+            delete_calendar_file(self.object.read_token, old_name + '.ics')
+            build_composite(self.object, force=True)
+        return response
+
+    def get_success_url(self):
+        return reverse('core:composite.detail', args=[self.object.pk])
+
+
+class CompositeCalendarUpdateView(OwnerRequiredMixin, CompositeCalendarFormMixin, generic.UpdateView):
+    queryset = CompositeCalendar.objects.select_related('user')
+
+
+class CompositeCalendarCreateView(CompositeCalendarFormMixin, generic.CreateView):
+    def form_valid(self, form):
+        form.instance.user = self.request.user
+        return super().form_valid(form)
+
+
+class CompositeCalendarDeleteView(OwnerRequiredMixin, generic.DeleteView):
+    model = CompositeCalendar
+    queryset = CompositeCalendar.objects.select_related('user')
+    template_name = 'delete.html'
+
+    def get_success_url(self):
+        return reverse('core:composite.list')
+
+
+@csrf_exempt
+@require_POST
+def gitlab_webhook(request, pk=None):
+    """
+    Receives the issue, milestone and iteration events of GitLab webhooks and queues a debounced regeneration
+    of the calendars that include the project or group of the event
+    """
+    api = get_object_or_404(GitLabAPI, pk=pk)
+    token = request.headers.get('X-Gitlab-Token', '')
+    if not api.webhook_secret or not hmac.compare_digest(token.encode(), api.webhook_secret.encode()):
+        return JsonResponse({'error': 'Invalid webhook token'}, status=403)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON payload'}, status=400)
+    if not isinstance(payload, dict) or payload.get('object_kind') not in CALENDAR_EVENTS:
+        return JsonResponse({'jobs': []})
+    project_id, group_id, namespaces = get_event_source(payload)
+    jobs = [enqueue_generation(config, delay=settings.GITCALENDAR_WEBHOOK_DEBOUNCE)
+            for config in get_affected_configurations(api, project_id, group_id, namespaces)]
+    return JsonResponse({'jobs': [job.pk for job in jobs]}, status=202 if jobs else 200)
+
+
+def job_status(job):
+    return {
+        'job': job.pk,
+        'status': job.status,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'status_url': reverse('core:ics.job', args=[job.configuration.write_token, job.pk]),
+    }
+
+
 def calendar_generating(request, token=None):
+    """
+    Queues the generation of the calendar, the job is processed by the run_generation_jobs command.
+    Concurrent requests attach to the queued or running job of the calendar instead of starting another one.
+    Browsers are redirected to the calendar, whose page shows the state of the job.
+    """
+    config = get_object_or_404(CalendarConfiguration, write_token=token)
+    job = enqueue_generation(config, join_running=True)
+    if 'text/html' in request.META.get('HTTP_ACCEPT', ''):
+        return redirect('core:calendar.detail', pk=config.pk)
+    response = JsonResponse(job_status(job), status=202)
+    response['Location'] = reverse('core:ics.job', args=[token, job.pk])
+    return response
+
+
+def generation_job(request, token=None, pk=None):
+    job = get_object_or_404(GenerationJob.objects.select_related('configuration'),
+                            pk=pk, configuration__write_token=token)
+    return JsonResponse(job_status(job))
+
+
+def accepted_encodings(header):
+    """
+    Parses an Accept-Encoding header into a mapping of content codings and their quality values
+    """
+    encodings = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding.strip():
+            encodings[coding.strip().lower()] = quality
+    return encodings
+
+
+def calendar_variant(request, token, filename):
+    """
+    Picks the best precompressed variant the client accepts, returns its storage name and content coding.
+    Variants that are older than the calendar itself are ignored.
+    """
+    name = calendar_name(token, filename)
+    accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    for encoding, extension in COMPRESSED_ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0.0)) <= 0:
+            continue
+        try:
+            if calendar_storage.get_modified_time(name + extension) >= calendar_storage.get_modified_time(name):
+                return name + extension, encoding
+        except OSError:
+            continue
+    return name, None
+
+
+def calendar_window(request):
+    """
+    Returns the first and last day of the requested window, given by the dates from and to or relative to today by
+    past_days and future_days. Open bounds are None, a request without window results in None.
+    """
+    params = request.GET
+    if not any(name in params for name in ('from', 'to', 'past_days', 'future_days')):
+        return None
+    today = localdate()
+    bounds = []
+    for date_name, days_name, sign in (('from', 'past_days', -1), ('to', 'future_days', 1)):
+        try:
+            if date_name in params:
+                bound = date.fromisoformat(params[date_name])
+            elif days_name in params:
+                bound = today + timedelta(days=sign * int(params[days_name]))
+            else:
+                bound = None
+        except (ValueError, OverflowError):
+            raise BadRequest(f"Invalid value for {date_name} or {days_name}")
+        bounds.append(bound)
+    return tuple(bounds)
+
+
+def window_etag(content_hash, window):
+    first, last = window
+    return f"{content_hash}-{first or ''}..{last or ''}"
+
+
+def calendar_content_hash(token, filename):
+    """
+    The content hash is stored when a calendar is written, it is only known for the file of the configuration or
+    composite calendar itself
+    """
+    for model, name_field in ((CalendarConfiguration, 'config_name'), (CompositeCalendar, 'name')):
+        record = model.objects.filter(read_token=token).values_list(name_field, 'content_hash').first()
+        if record is not None:
+            return record[1] if filename == record[0] + '.ics' else ''
+    return ''
+
+
+def calendar_etag(request, token=None, filename=None):
+    content_hash = calendar_content_hash(token, filename)
+    if not content_hash:
+        return None
+    window = calendar_window(request)
+    if window is not None:
+        return window_etag(content_hash, window)
+    encoding = calendar_variant(request, token, filename)[1]
+    return content_hash if encoding is None else f"{content_hash}-{encoding}"
+
+
+def calendar_last_modified(request, token=None, filename=None):
     try:
-        config = CalendarConfiguration.objects.get(write_token__exact=token)
-        generator(config)
-        config.file_exists = True
-        config.save()
-        return HttpResponseRedirect(reverse('core:calendar.detail', args=[config.pk]))
-    except GitlabGetError as e:
-        response = render(request, 'error.html', {'heading': '400 Bad request', 'message': 'GitLab Authentication failed'})
-        response.status_code = 400
-        return response
-    except GitlabAuthenticationError as e:
-        response = render(request, 'error.html', {'heading': '401 Unauthorized', 'message': 'GitLab Authentication failed'})
-        response.status_code = 401
+        modified = calendar_storage.get_modified_time(calendar_name(token, filename))
+    except OSError:
+        return None
+    if 'past_days' in request.GET or 'future_days' in request.GET:
+        # a window relative to today shows other events every day, even if the calendar is unchanged
+        return max(modified, make_aware(datetime.combine(localdate(), datetime.min.time())))
+    return modified
+
+
+def offloaded_response(name):
+    """
+    Lets the front proxy send the file, nginx expects an internal url while apache and lighttpd expect the path
+    """
+    response = HttpResponse(content_type=CALENDAR_CONTENT_TYPE)
+    if settings.GITCALENDAR_SENDFILE == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = settings.GITCALENDAR_SENDFILE_URL + quote(name)
+    elif settings.GITCALENDAR_SENDFILE == 'x-sendfile':
+        try:
+            response['X-Sendfile'] = calendar_storage.path(name)
+        except NotImplementedError:
+            raise ImproperlyConfigured("x-sendfile needs a calendar storage with local paths")
+    else:
+        raise ImproperlyConfigured(f"Unknown GITCALENDAR_SENDFILE mode {settings.GITCALENDAR_SENDFILE!r}")
+    return response
+
+
+def cached_response(token, filename, name, encoding):
+    """
+    Serves hot calendars from the in-memory cache, large or uncached files are streamed
+    """
+    try:
+        stamp = (calendar_storage.get_modified_time(name), calendar_storage.size(name))
+    except OSError:
+        raise Http404()
+    key = (str(token), filename, encoding)
+    data = calendar_cache.get(key, stamp)
+    if data is None and calendar_cache.accepts(stamp[1]):
+        with calendar_storage.open(name, 'rb') as file:
+            data = file.read()
+        calendar_cache.put(key, stamp, data)
+    if data is not None:
+        return HttpResponse(data, content_type=CALENDAR_CONTENT_TYPE)
+    # the file is streamed, wsgi servers hand local files over to sendfile where available
+    return FileResponse(calendar_storage.open(name, 'rb'), content_type=CALENDAR_CONTENT_TYPE, filename=filename)
+
+
+def windowed_response(token, filename, window):
+    """
+    Serves the events of the window from the event table, the rendered window is cached until the next generation
+    """
+    config = CalendarConfiguration.objects.select_related('api').filter(read_token=token).first()
+    if config is None:
+        raise BadRequest("Windows are only available for the calendars of configurations")
+    if filename != config.config_name + '.ics':
+        raise Http404()
+    first, last = window
+    key = (str(token), filename, f'window:{first}:{last}')
+    data = calendar_cache.get(key, config.content_hash)
+    if data is None:
+        events = config.events.all()
+        if first is not None:
+            events = events.filter(start__gte=first)
+        if last is not None:
+            events = events.filter(start__lte=last)
+        content = render_calendar(events.iterator(), config.reminder, urlparse(config.api.url).netloc)
+        data = content.encode('utf-8')
+        calendar_cache.put(key, config.content_hash, data)
+    return HttpResponse(data, content_type=CALENDAR_CONTENT_TYPE)
+
+
+def refresh_when_stale(view):
+    """
+    Calendars are served even when they are older than their maximum age, the regeneration runs in the background
+    """
+    @wraps(view)
+    def wrapper(request, token=None, filename=None):
+        response = view(request, token=token, filename=filename)
+        if response.status_code in (200, 304):
+            refresh_if_stale(token)
         return response
+    return wrapper
 
 
+def observe_latency(view):
+    """
+    Records the duration of each calendar download by its status code
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = view(request, *args, **kwargs)
+            status = response.status_code
+            return response
+        except Http404:
+            status = 404
+            raise
+        except BadRequest:
+            status = 400
+            raise
+        finally:
+            metrics.observe('gitcalendar_calendar_response_seconds', time.perf_counter() - started, status=status)
+    return wrapper
+
+
+@observe_latency
+@refresh_when_stale
+@vary_on_headers('Accept-Encoding')
+@condition(etag_func=calendar_etag, last_modified_func=calendar_last_modified)
 def show_file(request, token=None, filename=None):
-    try:
-        path = settings.MEDIA_ROOT + "/" + str(token) + "/" + filename
-        with open(path, "r") as file:
-            content = file.read()
-        return HttpResponse(content, content_type="text/plain; encoding")
-    except Exception as e:
-        pass
+    if not calendar_storage.exists(calendar_name(token, filename)):
+        raise Http404()
+    window = calendar_window(request)
+    if window is not None:
+        return windowed_response(token, filename, window)
+    name, encoding = calendar_variant(request, token, filename)
+    if settings.GITCALENDAR_SENDFILE:
+        response = offloaded_response(name)
+    else:
+        response = cached_response(token, filename, name, encoding)
+    if encoding is not None:
+        response['Content-Encoding'] = encoding
+    return response
+
+
+def metrics_view(request):
+    """
+    Prometheus metrics of this process, for staff users or scrapers that send GITCALENDAR_METRICS_TOKEN as bearer
+    """
+    if not request.user.is_staff:
+        token = settings.GITCALENDAR_METRICS_TOKEN
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        if not token or not hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+            return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
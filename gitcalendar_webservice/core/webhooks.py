@@ -0,0 +1,36 @@
+from django.db.models import Q
+
+from core.models import CalendarEvent, CalendarMembership
+
+# object kinds of the GitLab webhook events that can change a calendar
+CALENDAR_EVENTS = ('issue', 'work_item', 'milestone', 'iteration')
+
+
+def get_event_source(payload):
+    """
+    Returns the project and group id of a webhook event, either may be None, and the paths of the groups and
+    subgroups that the project belongs to
+    """
+    attributes = payload.get('object_attributes') or {}
+    project_id = attributes.get('project_id') or (payload.get('project') or {}).get('id')
+    group_id = attributes.get('group_id') or (payload.get('group') or {}).get('group_id') or \
+        (payload.get('group') or {}).get('id')
+    parts = ((payload.get('project') or {}).get('path_with_namespace') or '').split('/')[:-1]
+    namespaces = ['/'.join(parts[:end]) for end in range(1, len(parts) + 1)]
+    return project_id, group_id, namespaces
+
+
+def get_affected_configurations(gitlab_api, project_id, group_id, namespaces=()):
+    """
+    Returns the configurations of the GitLab API that include the project or group of an event. Group configurations
+    are also affected by events of the projects whose items they show, or that are in the namespace of their groups.
+    """
+    memberships = Q(kind=CalendarMembership.GROUP, path__in=namespaces)
+    if group_id is not None:
+        memberships |= Q(kind=CalendarMembership.GROUP, gitlab_id=group_id)
+    if project_id is not None:
+        memberships |= Q(kind=CalendarMembership.PROJECT, gitlab_id=project_id)
+    affected = Q(pk__in=CalendarMembership.objects.filter(memberships).values('configuration'))
+    if project_id is not None:
+        affected |= Q(pk__in=CalendarEvent.objects.filter(project_id=project_id).values('configuration'))
+    return list(gitlab_api.configurations.filter(affected).order_by('pk'))
@@ -137,6 +137,50 @@ MEDIA_ROOT = str(BASE_DIR.parent.joinpath('media'))
 MEDIA_URL = 'calendar/'
 
 DEFAULT_CHARSET = "utf-8"
+
+# GitLab clients are reused between generations, the authentication is repeated after the ttl (seconds)
+GITCALENDAR_CLIENT_AUTH_TTL = 300
+GITCALENDAR_CLIENT_POOL_SIZE = 10
+
+# generations only fetch changed items, deleted items are dropped by a full sync after this interval (seconds)
+GITCALENDAR_FULL_SYNC_INTERVAL = 86400
+
+# Calendar files are streamed by django, or sent by the front proxy with 'x-accel-redirect' (nginx) or 'x-sendfile'.
+# For nginx GITCALENDAR_SENDFILE_URL has to be an internal location that is aliased to MEDIA_ROOT.
+GITCALENDAR_SENDFILE = None
+GITCALENDAR_SENDFILE_URL = '/protected-calendar/'
+
+# Rendered event fragments that no generation used for this many seconds are deleted by update_calendar
+GITCALENDAR_FRAGMENT_RETENTION = 7 * 86400
+
+# In-memory LRU of calendar contents per process, calendars above a tenth of the byte limit are streamed
+GITCALENDAR_CACHE_MAX_BYTES = 32 * 1024 * 1024
+GITCALENDAR_CACHE_MAX_ENTRIES = 1000
+
+# Regenerations triggered by GitLab webhooks wait until no further event arrived for this many seconds
+GITCALENDAR_WEBHOOK_DEBOUNCE = 30
+
+# Requests per second and GitLab host until GitLab reports its own limit with the RateLimit-* headers.
+# The buckets are shared between all threads and processes through the files in GITCALENDAR_THROTTLE_DIR.
+GITCALENDAR_THROTTLE_RATE = 10
+GITCALENDAR_THROTTLE_RETRIES = 5
+GITCALENDAR_THROTTLE_DIR = str(BASE_DIR.parent.joinpath('throttle'))
+
+# Requests in flight per GitLab host when update_calendar --asyncio or core.async_generator fetch the lists
+GITCALENDAR_ASYNC_PER_HOST = 20
+
+# Storage of the calendar files, core.storage.SharedDirectoryStorage keeps them in a directory that all nodes mount
+# and is given as {'location': ...} in GITCALENDAR_STORAGE_OPTIONS. MEDIA_ROOT is used without a location.
+GITCALENDAR_STORAGE = 'core.storage.LocalCalendarStorage'
+GITCALENDAR_STORAGE_OPTIONS = {}
+
+# A generation holds a lease on its configuration, so that no other node generates it at the same time.
+# The lease of a crashed node expires after this many seconds.
+GITCALENDAR_GENERATION_LEASE = 900
+
+# /metrics is shown to staff users and to scrapers that send this token as 'Authorization: Bearer <token>'
+GITCALENDAR_METRICS_TOKEN = None
+
 try:
     from gitcalendar_webservice.private_settings import *
 except ImportError:
@@ -14,6 +14,8 @@ DEVELOP_REQUIRES = [
 
 EXTRAS_REQUIRE = {
     "develop": DEVELOP_REQUIRES,
+    "brotli": ["brotli"],
+    "async": ["httpx"],
 }
 
 package = setuptools.find_packages()